@@ -0,0 +1,151 @@
+import argparse
+import logging
+import os
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+from database import DB_PATH, connect, now_ms, setup_database
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_NAME = 'archive.db'           # kept next to the main database
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '90'))
+ARCHIVE_BATCH_SIZE = 500              # orders moved per transaction
+VACUUM_STEP_PAGES = 2000              # free pages returned per incremental_vacuum
+TERMINAL_STATUSES = ('accepted', 'cancelled', 'expired')
+
+# Name of the monthly archive table for an order time, e.g. Orders_2024_01
+def month_table(order_time):
+    return f"Orders_{datetime.fromtimestamp(order_time / 1000).strftime('%Y_%m')}"
+
+def archive_path(db_path=DB_PATH):
+    return os.path.join(os.path.dirname(db_path), ARCHIVE_NAME)
+
+def _schemas(conn):
+    return {row[1]: row[2] for row in conn.execute("PRAGMA database_list")}
+
+def _columns(conn, schema, table):
+    return [row[1] for row in conn.execute(f'PRAGMA {schema}.table_info("{table}")')]
+
+# Attach the archive database as `archive` unless it already is. Read-only connections
+# (report.py) must be opened with uri=True.
+def attach_archive(conn, path=None, read_only=False):
+    schemas = _schemas(conn)
+    if 'archive' in schemas:
+        return
+    path = path or archive_path(schemas['main'])
+    if read_only:
+        conn.execute("ATTACH DATABASE ? AS archive", (f"file:{path}?mode=ro",))
+    else:
+        conn.execute("ATTACH DATABASE ? AS archive", (path,))
+        conn.execute("PRAGMA archive.journal_mode=WAL")
+
+# Create a monthly archive table with the columns of Orders, or add the columns a later
+# migration gave Orders to an existing one
+def _ensure_month_table(conn, table):
+    existing = set(_columns(conn, 'archive', table))
+    columns = [(row[1], row[2]) for row in conn.execute("PRAGMA main.table_info(Orders)")]
+    if not existing:
+        definitions = ', '.join(f"{name} {type_}{' PRIMARY KEY' if name == 'id' else ''}" for name, type_ in columns)
+        conn.execute(f'CREATE TABLE archive."{table}" ({definitions})')
+        conn.execute(f'CREATE INDEX archive."idx_{table}_time" ON "{table}" (order_time)')
+        return
+    for name, type_ in columns:
+        if name not in existing:
+            conn.execute(f'ALTER TABLE archive."{table}" ADD COLUMN {name} {type_}')
+
+# Move up to `limit` accepted, cancelled or expired orders placed before `cutoff` (epoch
+# ms) into their monthly archive tables. Returns how many were moved, 0 when done.
+# The copy is committed before the delete: the two files do not commit atomically, and
+# a crash in between only leaves rows the next batch copies again (INSERT OR IGNORE).
+def archive_batch(conn, cutoff, limit=ARCHIVE_BATCH_SIZE):
+    attach_archive(conn)
+    statuses = ', '.join('?' * len(TERMINAL_STATUSES))
+    rows = conn.execute(
+        f"SELECT id, order_time FROM Orders WHERE status IN ({statuses}) AND order_time < ? LIMIT ?",
+        (*TERMINAL_STATUSES, cutoff, limit)
+    ).fetchall()
+    if not rows:
+        return 0
+
+    by_month = {}
+    for row in rows:
+        by_month.setdefault(month_table(row['order_time']), []).append(row['id'])
+    for table, ids in by_month.items():
+        _ensure_month_table(conn, table)
+        columns = ', '.join(_columns(conn, 'main', 'Orders'))
+        conn.execute(
+            f'INSERT OR IGNORE INTO archive."{table}" ({columns}) '
+            f"SELECT {columns} FROM main.Orders WHERE id IN ({', '.join('?' * len(ids))})",
+            ids
+        )
+    conn.commit()
+
+    ids = [row['id'] for row in rows]
+    placeholders = ', '.join('?' * len(ids))
+    conn.execute(f"DELETE FROM OrderMessages WHERE order_id IN ({placeholders})", ids)
+    conn.execute(f"DELETE FROM Orders WHERE id IN ({placeholders})", ids)
+    conn.commit()
+    return len(ids)
+
+# Give up to `pages` free pages of the main database back to the filesystem, returns how
+# many were freed. Needs auto_vacuum=INCREMENTAL, which new databases get (see
+# database.CONNECTION_PRAGMAS) and older ones only after a full VACUUM.
+def vacuum_step(conn, pages=VACUUM_STEP_PAGES):
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return 0
+    before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+    return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+# Temp view AllOrders over the hot Orders table and every monthly archive table, for
+# reporting. Archive tables missing a newer column read it as NULL.
+def create_unified_view(conn):
+    columns = _columns(conn, 'main', 'Orders')
+    selects = [f"SELECT {', '.join(columns)} FROM main.Orders"]
+    if 'archive' in _schemas(conn):
+        tables = conn.execute(
+            "SELECT name FROM archive.sqlite_master WHERE type = 'table' AND name GLOB 'Orders_[0-9]*' ORDER BY name"
+        ).fetchall()
+        for (table,) in tables:
+            present = set(_columns(conn, 'archive', table))
+            fields = ', '.join(column if column in present else f"NULL AS {column}" for column in columns)
+            selects.append(f'SELECT {fields} FROM archive."{table}"')
+    conn.execute("DROP VIEW IF EXISTS temp.AllOrders")
+    conn.execute(f"CREATE TEMP VIEW AllOrders AS {' UNION ALL '.join(selects)}")
+
+
+# Archive everything due in one go, e.g. from cron. The first run on a database created
+# before incremental vacuum rewrites it once with a full VACUUM.
+def main(argv=None):
+    # ARCHIVE_AFTER_DAYS was read at import, before .env could be loaded
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Move old finished orders to the archive database.")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--days', type=int, default=int(os.getenv('ARCHIVE_AFTER_DAYS', ARCHIVE_AFTER_DAYS)), help="archive orders older than this")
+    parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    setup_database(args.db)
+    conn = connect(args.db)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            print("Enabling incremental vacuum, rewriting the database once...")
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+
+        cutoff = now_ms() - args.days * 24 * 60 * 60 * 1000
+        archived = 0
+        while moved := archive_batch(conn, cutoff, args.batch_size):
+            archived += moved
+        freed = 0
+        while pages := vacuum_step(conn):
+            freed += pages
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        print(f"Archived {archived} orders older than {args.days} days, freed {freed} pages.")
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
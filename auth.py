@@ -0,0 +1,86 @@
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+DEVLIST_PATH = 'data/devlist.json'
+DEVLIST_CHECK_INTERVAL = 5       # seconds between devlist.json mtime checks
+BLOCKLIST_REFRESH_INTERVAL = 60  # seconds before the blocklist is reloaded anyway
+
+AUTHORIZED = 'authorized'
+NOT_AUTHORIZED = 'not_authorized'
+BLOCKED = 'blocked'
+
+
+# Answers /start authorization from memory. When devlist.json exists only the users
+# in it may use the bot, otherwise everyone except blocked customers may.
+class Authorizer:
+    def __init__(self, repo, devlist_path=DEVLIST_PATH):
+        self.repo = repo
+        self.devlist_path = devlist_path
+        self.allowlist = None
+        self.blocklist = set()
+        self._devlist_mtime = None
+        self._next_devlist_check = 0
+        self._blocklist_expires = 0
+        self.stats = {'hits': 0, 'misses': 0, 'devlist_reloads': 0, 'blocklist_reloads': 0}
+
+    # Signal that Customers.is_blocked changed so the next check reloads it
+    def invalidate_blocklist(self):
+        self._blocklist_expires = 0
+
+    # Block or unblock a customer. This process sees it on the next check, other workers
+    # within BLOCKLIST_REFRESH_INTERVAL.
+    async def set_blocked(self, user_id, blocked):
+        await self.repo.set_blocked(user_id, blocked)
+        self.invalidate_blocklist()
+
+    def _refresh_allowlist(self, now):
+        if now < self._next_devlist_check:
+            return False
+        self._next_devlist_check = now + DEVLIST_CHECK_INTERVAL
+        try:
+            mtime = os.stat(self.devlist_path).st_mtime
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._devlist_mtime:
+            return False
+
+        if mtime is None:
+            self.allowlist = None
+        else:
+            # A file caught mid-write or with a typo keeps the last good list, and its mtime
+            # is not recorded so the next check tries it again
+            try:
+                with open(self.devlist_path, 'r') as f:
+                    allowlist = set(json.load(f))
+            except (OSError, ValueError, TypeError) as e:
+                logger.error("Could not load %s, keeping the previous allowlist: %s", self.devlist_path, e)
+                return False
+            self.allowlist = allowlist
+        self._devlist_mtime = mtime
+        self.stats['devlist_reloads'] += 1
+        logger.info("Reloaded %s: %s allowed users", self.devlist_path, len(self.allowlist) if self.allowlist is not None else 'no')
+        return True
+
+    async def _refresh_blocklist(self, now):
+        if now < self._blocklist_expires:
+            return False
+        self.blocklist = await self.repo.get_blocked_user_ids()
+        self._blocklist_expires = now + BLOCKLIST_REFRESH_INTERVAL
+        self.stats['blocklist_reloads'] += 1
+        logger.info("Reloaded blocklist: %s blocked customers", len(self.blocklist))
+        return True
+
+    async def check(self, user_id):
+        now = time.monotonic()
+        reloaded = self._refresh_allowlist(now)
+        if self.allowlist is not None:
+            result = AUTHORIZED if user_id in self.allowlist else NOT_AUTHORIZED
+        else:
+            reloaded = await self._refresh_blocklist(now) or reloaded
+            result = BLOCKED if user_id in self.blocklist else AUTHORIZED
+        self.stats['misses' if reloaded else 'hits'] += 1
+        return result
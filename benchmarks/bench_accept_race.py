@@ -0,0 +1,72 @@
+# 50 runners race to accept the same order, each on its own thread and connection,
+# so the race is decided inside SQLite. Exactly one must win every round.
+#
+#   python benchmarks/bench_accept_race.py [runners] [rounds]
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from common import percentile
+
+import database
+import repository
+from database import now_ms
+
+
+def race(db_path, order_id, runners, winners, loser_latencies):
+    barrier = threading.Barrier(runners)
+    lock = threading.Lock()
+
+    def runner(runner_id):
+        conn = database.connect(db_path)
+        try:
+            barrier.wait()
+            start = time.perf_counter()
+            order = repository.accept_order(conn, order_id, runner_id, f"runner{runner_id}", now_ms())
+            elapsed = time.perf_counter() - start
+        finally:
+            conn.close()
+        with lock:
+            if order:
+                winners.append(runner_id)
+            else:
+                loser_latencies.append(elapsed)
+
+    threads = [threading.Thread(target=runner, args=(i,)) for i in range(runners)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def main():
+    runners = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    failed_rounds = 0
+    loser_latencies = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'race.db')
+        database.setup_database(db_path)
+        conn = database.connect(db_path)
+        repository.ensure_customer(conn, 1, 'customer')
+        for i in range(rounds):
+            order_id = f"RACE_{i}"
+            repository.insert_order(conn, order_id, 1, 'food', 'Zubair', 'Ali', now_ms())
+            winners = []
+            race(db_path, order_id, runners, winners, loser_latencies)
+            if len(winners) != 1:
+                failed_rounds += 1
+                print(f"round {i}: {len(winners)} winners")
+        conn.close()
+
+    print(f"{rounds} rounds x {runners} runners, rounds without exactly one winner: {failed_rounds}")
+    print(f"loser rejection p50={percentile(loser_latencies, 50) * 1000:.2f} ms  "
+          f"p99={percentile(loser_latencies, 99) * 1000:.2f} ms")
+    if failed_rounds:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
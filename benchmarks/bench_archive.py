@@ -0,0 +1,107 @@
+# Hot-path query latency as order history grows, with and without archive.py. Two
+# databases get the same orders: a steady set of recent ones plus `step` old finished
+# orders per round. One of them is archived after every round. The queries timed are
+# the ones behind accepting an order, the open order cap and /myorders.
+#
+#   python benchmarks/bench_archive.py [rounds] [step]
+import os
+import random
+import sys
+import tempfile
+import time
+
+from common import percentile
+
+from archive import archive_batch, vacuum_step
+from database import connect, now_ms, setup_database
+from repository import count_pending_orders, fetch_order, fetch_order_page, transition_order
+
+CUSTOMERS = 5000
+RECENT_ORDERS = 20000
+SAMPLES = 2000
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+def orders(first, count, newest, span_days, statuses):
+    rng = random.Random(first)
+    for i in range(first, first + count):
+        yield (
+            f"ORDER_{i:09d}", rng.randrange(CUSTOMERS), 'food', 'Library', 'KICT',
+            newest - rng.randrange(span_days * DAY_MS), rng.choice(statuses),
+        )
+
+
+def insert(conn, rows):
+    conn.executemany('''
+        INSERT INTO Orders (id, customer_id, delivery_type, from_location, to_location, order_time, status)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    conn.commit()
+
+
+# p50 and p99 in microseconds of the hot queries on a fresh connection
+def measure(db_path, recent_ids):
+    conn = connect(db_path)
+    rng = random.Random(1)
+    timings = {'accept': [], 'pending count': [], 'history page': []}
+    for _ in range(SAMPLES):
+        order_id = rng.choice(recent_ids)
+        started = time.perf_counter()
+        transition_order(conn, order_id, 'pending', 'accepted', runner_id=1, accept_time=now_ms())
+        fetch_order(conn, order_id)
+        timings['accept'].append(time.perf_counter() - started)
+        conn.rollback()
+
+        customer_id = rng.randrange(CUSTOMERS)
+        started = time.perf_counter()
+        count_pending_orders(conn, customer_id)
+        timings['pending count'].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        fetch_order_page(conn, 'customer_id', customer_id, None, True, 5)
+        timings['history page'].append(time.perf_counter() - started)
+    conn.close()
+    return {name: (percentile(samples, 50) * 1e6, percentile(samples, 99) * 1e6) for name, samples in timings.items()}
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    step = int(sys.argv[2]) if len(sys.argv) > 2 else 250000
+    now = now_ms()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = {}
+        for name in ('growing', 'archived'):
+            os.makedirs(os.path.join(tmp, name))
+            paths[name] = os.path.join(tmp, name, 'makanApa.db')
+            setup_database(paths[name])
+            conn = connect(paths[name])
+            conn.executemany("INSERT INTO Customers (user_id, username) VALUES (?, ?)", ((i, f"c{i}") for i in range(CUSTOMERS)))
+            insert(conn, orders(0, RECENT_ORDERS, now, 7, ('pending', 'accepted')))
+            conn.close()
+        conn = connect(paths['growing'])
+        recent_ids = [row[0] for row in conn.execute("SELECT id FROM Orders WHERE status = 'pending'")]
+        conn.close()
+
+        print(f"{RECENT_ORDERS} recent orders, {step} old ones added per round, p50/p99 in us")
+        for round_ in range(rounds + 1):
+            if round_:
+                for name, path in paths.items():
+                    conn = connect(path)
+                    insert(conn, orders(RECENT_ORDERS + round_ * step, step, now - 180 * DAY_MS, 365, ('accepted', 'cancelled', 'expired')))
+                    if name == 'archived':
+                        while archive_batch(conn, now - 90 * DAY_MS):
+                            pass
+                        while vacuum_step(conn):
+                            pass
+                        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                    conn.close()
+            for name, path in paths.items():
+                results = measure(path, recent_ids)
+                size = sum(os.path.getsize(file) for file in (path, path + '-wal') if os.path.exists(file))
+                line = '  '.join(f"{query} {p50:4.0f}/{p99:<4.0f}" for query, (p50, p99) in results.items())
+                print(f"history {round_ * step:>8}  {name:<8} {size / 2 ** 20:6.1f} MiB  {line}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+# End-to-end load benchmark: synthetic customers go /start -> confirm against the fake
+# Bot API and a runner accepts each order. Reports orders per second and latency per
+# stage, and compares them with a saved baseline so regressions show up.
+#
+#   python benchmarks/bench_e2e.py --users 2000 --concurrency 200
+#   python benchmarks/bench_e2e.py --save-baseline     # record the current numbers
+#
+# Numbers depend on the machine, record the baseline on the one you compare on.
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import sys
+import tempfile
+import time
+
+from common import percentile
+from check_workers import RUNNERS, place_order, start_workers
+from fake_bot_api import FakeBotAPI
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+STAGE_TIMEOUT = 30
+
+
+async def customer(api, user_id, timings):
+    order_id, _, index = await place_order(api, user_id, timings)
+
+    # Confirmation to the order appearing in the runner group
+    started = time.perf_counter()
+    post = await api.wait_for_button(f"accept_{order_id}", STAGE_TIMEOUT)
+    timings.setdefault('runner post', []).append(time.perf_counter() - started)
+
+    runner = random.choice(RUNNERS)
+    started = time.perf_counter()
+    await api.click(runner, post, f"accept_{order_id}")
+    await api.wait_for(lambda m, c, msg: c == runner and f"accepted the order #{order_id}" in msg['text'], index, STAGE_TIMEOUT)
+    timings.setdefault('accept', []).append(time.perf_counter() - started)
+
+
+async def run(args):
+    api = await FakeBotAPI(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000, flood_ratio=args.flood_ratio).start()
+    timings = {}
+    failed = 0
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def one(user_id):
+        nonlocal failed
+        async with slots:
+            try:
+                await customer(api, user_id, timings)
+            except asyncio.TimeoutError:
+                failed += 1
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, 'workers.out'), 'w') as out:
+            process = await start_workers(api, tmp, args.workers, out, CHAT_RATE_PER_MINUTE=str(args.chat_rate))
+            try:
+                started = time.perf_counter()
+                await asyncio.gather(*(one(10000 + i) for i in range(args.users)))
+                elapsed = time.perf_counter() - started
+            finally:
+                process.send_signal(signal.SIGINT)
+                await process.wait()
+    await api.stop()
+
+    return {
+        'config': {key: getattr(args, key) for key in ('users', 'concurrency', 'workers', 'latency_ms', 'jitter_ms', 'flood_ratio', 'chat_rate')},
+        'orders_per_second': round((args.users - failed) / elapsed, 2),
+        'failed': failed,
+        'api_calls': api.calls,
+        'stages': {
+            stage: {'p50_ms': round(percentile(samples, 50) * 1000, 1), 'p95_ms': round(percentile(samples, 95) * 1000, 1)}
+            for stage, samples in timings.items()
+        },
+    }
+
+
+# Throughput drops and stage p95 increases beyond `tolerance` (a fraction) of the baseline
+def regressions(result, baseline, tolerance):
+    found = []
+    if result['orders_per_second'] < baseline['orders_per_second'] * (1 - tolerance):
+        found.append(f"orders/s {result['orders_per_second']} vs baseline {baseline['orders_per_second']}")
+    for stage, numbers in baseline['stages'].items():
+        current = result['stages'].get(stage)
+        if current and current['p95_ms'] > numbers['p95_ms'] * (1 + tolerance):
+            found.append(f"{stage} p95 {current['p95_ms']} ms vs baseline {numbers['p95_ms']} ms")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load benchmark against the fake Bot API.")
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=200, help="customers in flight at once")
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--latency-ms', type=float, default=20, help="fake Bot API latency per call")
+    parser.add_argument('--jitter-ms', type=float, default=10)
+    parser.add_argument('--flood-ratio', type=float, default=0.0, help="share of sends answered with 429")
+    parser.add_argument('--chat-rate', type=float, default=1000000, help="CHAT_RATE_PER_MINUTE for the bot")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(f"{args.users} users, {args.workers} workers: {result['orders_per_second']} orders/s, {result['failed']} failed")
+    for stage, numbers in result['stages'].items():
+        print(f"  {stage:<18} p50={numbers['p50_ms']:8.1f} ms  p95={numbers['p95_ms']:8.1f} ms")
+    print(f"  Bot API calls: {result['api_calls']}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print("No baseline yet, run with --save-baseline to record one.")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline['config'] != result['config']:
+        print(f"Baseline was recorded with {baseline['config']}, not comparing.")
+        return
+    found = regressions(result, baseline, args.tolerance)
+    for regression in found:
+        print(f"REGRESSION: {regression}")
+    if found or result['failed']:
+        sys.exit(1)
+    print("Within tolerance of the baseline.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# Acceptance side effects against a stub bot with a fixed round trip: the old
+# sequential awaits versus notifications.dispatch. The stub's delete_message fails,
+# which used to abort the runner DM.
+#
+#   python benchmarks/bench_fanout.py [round_trip_ms]
+import asyncio
+import sys
+import time
+
+import common  # noqa: F401, puts the repository root on sys.path
+
+from notifications import dispatch
+
+
+class StubBot:
+    def __init__(self, round_trip):
+        self.round_trip = round_trip
+        self.sent = []
+
+    async def edit_message_text(self, text, **kwargs):
+        await asyncio.sleep(self.round_trip)
+        self.sent.append('edit')
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(self.round_trip)
+        self.sent.append(f'send:{chat_id}')
+
+    async def delete_message(self, chat_id, message_id):
+        await asyncio.sleep(self.round_trip)
+        raise RuntimeError("Message to delete not found")
+
+
+async def sequential(bot):
+    await bot.edit_message_text("accepted")
+    await bot.send_message(1, "accepted")
+    await bot.delete_message(1, 10)
+    await bot.send_message(2, "dm")
+
+
+async def concurrent(bot):
+    await dispatch({
+        'edit runner group message': bot.edit_message_text("accepted"),
+        'notify customer': bot.send_message(1, "accepted"),
+        'delete previous customer message': bot.delete_message(1, 10),
+        'DM runner': bot.send_message(2, "dm"),
+    }, order_id='BENCH')
+
+
+async def measure(label, flow, round_trip):
+    bot = StubBot(round_trip)
+    start = time.perf_counter()
+    try:
+        await flow(bot)
+    except RuntimeError:
+        pass
+    elapsed = time.perf_counter() - start
+    print(f"{label:<12} {elapsed * 1000:7.1f} ms ({elapsed / round_trip:.1f} round trips), "
+          f"runner DM sent: {'send:2' in bot.sent}")
+
+
+async def main():
+    round_trip = (float(sys.argv[1]) if len(sys.argv) > 1 else 100) / 1000
+    await measure("sequential", sequential, round_trip)
+    await measure("dispatch", concurrent, round_trip)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
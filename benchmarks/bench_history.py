@@ -0,0 +1,76 @@
+# /myorders page latency for a customer with many orders: keyset pagination on
+# (order_time, id), as repository.fetch_order_page() does, against LIMIT/OFFSET at the
+# same depth. Keyset pages should cost the same at any depth.
+#
+#   python benchmarks/bench_history.py [orders]
+import os
+import sys
+import tempfile
+import time
+
+import common  # noqa: F401, puts the repository root on sys.path
+
+from database import connect, setup_database
+from history import PAGE_SIZE
+from repository import fetch_order_page
+
+CUSTOMER_ID = 1
+OTHER_CUSTOMERS = 1000
+REPEATS = 200
+
+OFFSET_PAGE = '''
+    SELECT id, status, delivery_type, from_location, to_location, order_time FROM Orders
+    WHERE customer_id = ? ORDER BY order_time DESC, id DESC LIMIT ? OFFSET ?
+'''
+
+
+def fill(conn, orders):
+    start = 1_700_000_000_000
+    rows = (
+        (f"ORDER_{i}", CUSTOMER_ID if i % 2 else 2 + i % OTHER_CUSTOMERS, 'food', 'Library', 'KICT', start + i * 1000, 'accepted')
+        for i in range(orders * 2)
+    )
+    conn.executemany('''
+        INSERT INTO Orders (id, customer_id, delivery_type, from_location, to_location, order_time, status)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    conn.commit()
+
+
+def timed(func):
+    started = time.perf_counter()
+    for _ in range(REPEATS):
+        result = func()
+    return (time.perf_counter() - started) / REPEATS, result
+
+
+def main():
+    orders = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'history.db')
+        setup_database(db_path)
+        conn = connect(db_path)
+        fill(conn, orders)
+
+        # Walk to each depth once to get the keyset cursor there
+        cursors = {0: None}
+        depths = [d for d in (1, 10, 100, 1000, 5000) if d * PAGE_SIZE < orders]
+        cursor, page = None, 0
+        while page < depths[-1]:
+            rows, _ = fetch_order_page(conn, 'customer_id', CUSTOMER_ID, cursor, True, PAGE_SIZE)
+            cursor = (rows[-1]['order_time'], rows[-1]['id'])
+            page += 1
+            if page in depths:
+                cursors[page] = cursor
+
+        print(f"customer with {orders} orders, {PAGE_SIZE} per page")
+        for depth, cursor in cursors.items():
+            keyset, (rows, _) = timed(lambda: fetch_order_page(conn, 'customer_id', CUSTOMER_ID, cursor, True, PAGE_SIZE))
+            offset, offset_rows = timed(lambda: conn.execute(OFFSET_PAGE, (CUSTOMER_ID, PAGE_SIZE, depth * PAGE_SIZE)).fetchall())
+            assert [row['id'] for row in rows] == [row['id'] for row in offset_rows]
+            print(f"  page {depth:>5}: keyset {keyset * 1e6:7.0f} us   offset {offset * 1e6:7.0f} us")
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+# Lookup latency, memory and hit rate of locations.LocationIndex at 100k distinct
+# location names. Queries are known names with the words shuffled, the case changed
+# and the last word cut short, like "Zubair caf" for "Cafe Zubair".
+#
+#   python benchmarks/bench_locations.py [locations] [queries]
+import gc
+import random
+import sys
+import time
+import tracemalloc
+
+from common import percentile
+
+from locations import LocationIndex, location_key
+
+PLACES = ["Cafe", "Kopitiam", "Library", "Masjid", "Hall", "Block", "Gate", "Mart", "Stall", "Kiosk",
+          "Faculty", "Office", "Court", "Field", "Station", "Center", "Canteen", "Lab", "Clinic", "Bank"]
+SYLLABLES = [consonant + vowel for consonant in "bdfhjklmnrstwyz" for vowel in "aeiou"]
+
+
+def random_word(rng):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))).capitalize()
+
+
+def location_names(count, rng):
+    names, keys = [], set()
+    while len(names) < count:
+        words = [rng.choice(PLACES)] + [random_word(rng) for _ in range(rng.randint(1, 3))]
+        rng.shuffle(words)
+        name = ' '.join(words)
+        key = location_key(name)
+        if key not in keys:
+            keys.add(key)
+            names.append(name)
+    return names
+
+
+def typo(name, rng):
+    words = name.lower().split()
+    rng.shuffle(words)
+    if len(words[-1]) > 4:
+        words[-1] = words[-1][:-1]
+    return ' '.join(words)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    queries = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    rng = random.Random(1)
+    names = location_names(count, rng)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    index = LocationIndex()
+    index.load((location_id, name, location_key(name), rng.randrange(100)) for location_id, name in enumerate(names, 1))
+    build = time.perf_counter() - started
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # As bot.py does after loading the index
+    gc.collect()
+    gc.freeze()
+
+    latencies, hits = [], 0
+    for _ in range(queries):
+        location_id = rng.randrange(1, count + 1)
+        query = typo(names[location_id - 1], rng)
+        started = time.perf_counter()
+        matches = index.match(query)
+        latencies.append(time.perf_counter() - started)
+        hits += any(match[0] == location_id for match in matches)
+
+    print(f"{count} locations: built in {build:.2f}s, {memory / 2 ** 20:.1f} MiB")
+    print(f"match p50={percentile(latencies, 50) * 1e6:.0f} us  p99={percentile(latencies, 99) * 1e6:.0f} us  "
+          f"max={max(latencies) * 1e6:.0f} us")
+    print(f"right location in the suggestions for {hits / queries:.1%} of {queries} queries")
+
+
+if __name__ == '__main__':
+    main()
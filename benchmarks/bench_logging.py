@@ -0,0 +1,79 @@
+# How much time logging adds to each handler: the old basicConfig setup (synchronous
+# file + console writes, f-strings, DEBUG) versus the queue pipeline in logging_setup.
+#
+#   python benchmarks/bench_logging.py [handlers]
+import io
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from common import percentile
+
+import logging_setup
+
+logger = logging.getLogger('bench')
+
+
+# The log calls handle_confirmation makes for one order, old f-string style
+def handler_fstrings(i):
+    order_id, user_id = f"ORDER_240101_120000_{i}", 1000 + i
+    logger.debug(f"New customer inserted: user_id={user_id}, username=user{i}")
+    logger.info(f"Order ID generated: {order_id} for user {user_id}")
+    logger.debug(f"New order inserted: order_id={order_id}, customer_id={user_id}")
+    logger.info(f"Order ID: {order_id} sent to runner group.")
+    logger.info(f"User {user_id} confirmed order. Order ID: {order_id}")
+
+
+def handler_lazy(i):
+    order_id, user_id = f"ORDER_240101_120000_{i}", 1000 + i
+    extra = {'order_id': order_id, 'user_id': user_id}
+    logger.debug("New customer inserted: user_id=%s, username=%s", user_id, f"user{i}", extra=extra)
+    logger.info("Order ID generated: %s for user %s", order_id, user_id, extra=extra)
+    logger.debug("New order inserted: order_id=%s, customer_id=%s", order_id, user_id, extra=extra)
+    logger.info("Order ID: %s sent to runner group.", order_id, extra=extra)
+    logger.info("User %s confirmed order. Order ID: %s", user_id, order_id, extra=extra)
+
+
+def measure(handler, n):
+    samples = []
+    for i in range(n):
+        start = time.perf_counter()
+        handler(i)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def report(label, samples):
+    print(f"{label:<10} p50={percentile(samples, 50) * 1e6:8.1f} us  "
+          f"p99={percentile(samples, 99) * 1e6:8.1f} us  per handler")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    root = logging.getLogger()
+    with tempfile.TemporaryDirectory() as tmp:
+        # Old setup; the console goes to a buffer so the terminal does not dominate
+        file_handler = logging.FileHandler(os.path.join(tmp, 'before.log'))
+        console_handler = logging.StreamHandler(io.StringIO())
+        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+        for handler in (file_handler, console_handler):
+            handler.setFormatter(formatter)
+            root.addHandler(handler)
+        root.setLevel(logging.INFO)
+        logger.setLevel(logging.DEBUG)
+        report("before", measure(handler_fstrings, n))
+        for handler in (file_handler, console_handler):
+            root.removeHandler(handler)
+            handler.close()
+        logger.setLevel(logging.NOTSET)
+
+        listener = logging_setup.setup_logging(os.path.join(tmp, 'after.log'), 'INFO')
+        listener.handlers[1].setStream(io.StringIO())
+        report("after", measure(handler_lazy, n))
+        logging_setup.stop_logging()
+
+
+if __name__ == '__main__':
+    main()
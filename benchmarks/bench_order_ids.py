@@ -0,0 +1,58 @@
+# Concurrency stress test for the order number allocator: several processes, each
+# with many concurrent confirmations, allocate numbers from one database.
+#
+#   python benchmarks/bench_order_ids.py [processes] [orders_per_process]
+import asyncio
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import common  # noqa: F401, puts the repository root on sys.path
+
+from database import setup_database
+from repository import Repository
+
+CONCURRENCY = 100
+
+
+def allocate(db_path, count):
+    async def run():
+        repo = Repository(db_path)
+        numbers = []
+
+        async def worker(share):
+            for _ in range(share):
+                numbers.append(await repo.next_order_number())
+
+        try:
+            await asyncio.gather(*(worker(count // CONCURRENCY) for _ in range(CONCURRENCY)))
+        finally:
+            repo.close()
+        return numbers
+
+    return asyncio.run(run())
+
+
+def main():
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    per_process = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'ids.db')
+        setup_database(db_path)
+        start = time.perf_counter()
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.starmap(allocate, [(db_path, per_process)] * processes)
+        elapsed = time.perf_counter() - start
+
+    numbers = [n for result in results for n in result]
+    duplicates = len(numbers) - len(set(numbers))
+    print(f"allocated {len(numbers)} numbers in {elapsed:.2f}s "
+          f"({len(numbers) / elapsed:,.0f}/s), duplicates={duplicates}")
+    if duplicates:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
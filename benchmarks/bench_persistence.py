@@ -0,0 +1,60 @@
+# Conversation persistence at scale: flush cost for N concurrent users mid-order, and
+# memory per active conversation once they are loaded back after a restart.
+#
+#   python benchmarks/bench_persistence.py [users]
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import common  # noqa: F401, puts the repository root on sys.path
+
+from database import setup_database
+from persistence import SQLitePersistence
+from repository import Repository
+
+CONVERSATION = 'order_conversation'
+CONFIRMING_ORDER = 7
+
+
+async def run(users, db_path):
+    repo = Repository(db_path)
+    try:
+        persistence = SQLitePersistence(repo)
+        start = time.perf_counter()
+        for user_id in range(users):
+            await persistence.update_conversation(CONVERSATION, (user_id, user_id), CONFIRMING_ORDER)
+            await persistence.update_user_data(user_id, {
+                'delivery_type': 'food', 'from_category': 'brother',
+                'from_location': 'Zubair', 'to_category': 'sister', 'to_location': 'Aminah',
+            })
+        buffered = time.perf_counter() - start
+        await persistence.flush()
+        print(f"buffered {users} users in {buffered * 1000:.1f} ms, "
+              f"flush of {persistence.stats['records_written']} records took {persistence.stats['last_flush_ms']:.1f} ms")
+
+        restarted = SQLitePersistence(repo)
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        conversations = await restarted.get_conversations(CONVERSATION)
+        user_data = await restarted.get_user_data()
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+        print(f"restored {len(conversations)} conversations, {size / len(user_data):.0f} bytes per active conversation")
+    finally:
+        repo.close()
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'persistence.db')
+        setup_database(db_path)
+        asyncio.run(run(users, db_path))
+
+
+if __name__ == '__main__':
+    main()
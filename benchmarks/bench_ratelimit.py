@@ -0,0 +1,50 @@
+# Cost of ratelimit.UserRateLimiter.check() and its memory as users come and go.
+# Simulated time moves on by `step` seconds per update, so with many users most
+# buckets go idle and must be evicted for memory to stay bounded.
+#
+#   python benchmarks/bench_ratelimit.py [updates] [users]
+import random
+import sys
+import time
+import tracemalloc
+from unittest import mock
+
+import common  # noqa: F401, puts the repository root on sys.path
+
+from ratelimit import ALLOWED, UserRateLimiter
+
+
+def main():
+    updates = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+    step = 0.01
+    rng = random.Random(1)
+    # Ten spammers send half of all updates
+    spammers = 10
+    user_ids = [rng.randrange(spammers) if rng.random() < 0.5 else rng.randrange(spammers, users) for _ in range(updates)]
+
+    limiter = UserRateLimiter()
+    clock = [0.0]
+    allowed = {'spammer': 0, 'other': 0}
+    peak = 0
+    tracemalloc.start()
+    with mock.patch('time.monotonic', lambda: clock[0]):
+        started = time.perf_counter()
+        for user_id in user_ids:
+            clock[0] += step
+            if limiter.check(user_id) == ALLOWED:
+                allowed['spammer' if user_id < spammers else 'other'] += 1
+            peak = max(peak, len(limiter))
+        elapsed = time.perf_counter() - started
+    memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    print(f"{updates} updates from {users} users over {updates * step / 3600:.1f} simulated hours")
+    print(f"check() {elapsed / updates * 1e6:.2f} us per update (tracemalloc on)")
+    print(f"buckets: peak {peak}, now {len(limiter)}, evicted {limiter.stats['evicted']}, peak memory {memory / 2 ** 20:.1f} MiB")
+    print(f"allowed: {allowed['spammer']} spammer updates, {allowed['other']} of the others' "
+          f"({limiter.stats['dropped']} dropped)")
+
+
+if __name__ == '__main__':
+    main()
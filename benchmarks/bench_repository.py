@@ -0,0 +1,80 @@
+# Load benchmark: simulated confirm/accept updates with blocking sqlite3 calls on the
+# event loop (old handlers) versus the threaded Repository.
+#
+#   python benchmarks/bench_repository.py [updates]
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from common import percentile
+
+from database import now_ms, setup_database
+import repository
+from repository import Repository
+
+API_LATENCY = 0.005   # simulated Telegram round trip
+ARRIVAL_INTERVAL = 0.0005
+
+
+# Old pattern: a fresh connection per handler with queries run inline on the loop
+def blocking_call(db_path, func, *args):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        return func(conn, *args)
+    finally:
+        conn.close()
+
+
+async def simulate(n, db_path, call):
+    latencies = []
+
+    async def confirm_then_accept(i):
+        await asyncio.sleep(i * ARRIVAL_INTERVAL)
+        start = time.perf_counter()
+        order_id = f"BENCH_{i}"
+        await asyncio.sleep(API_LATENCY)  # query.answer()
+        await call(repository.ensure_customer, i, f"user{i}")
+        await call(repository.insert_order, order_id, i, 'food', 'Zubair', 'Ali', now_ms())
+        await asyncio.sleep(API_LATENCY)  # post to runner group
+        await call(repository.accept_order, order_id, 10_000 + i, f"runner{i}", now_ms())
+        latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(confirm_then_accept(i) for i in range(n)))
+    return latencies
+
+
+async def run_blocking(n, db_path):
+    async def call(func, *args):
+        return blocking_call(db_path, func, *args)
+    return await simulate(n, db_path, call)
+
+
+async def run_repository(n, db_path):
+    repo = Repository(db_path)
+    try:
+        return await simulate(n, db_path, repo.run)
+    finally:
+        print(f"repository stats: {repo.stats()}")
+        repo.close()
+
+
+def report(label, latencies):
+    print(f"{label:<12} p50={percentile(latencies, 50) * 1000:8.2f} ms  "
+          f"p99={percentile(latencies, 99) * 1000:8.2f} ms  n={len(latencies)}")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, runner in (("before", run_blocking), ("after", run_repository)):
+            db_path = os.path.join(tmp, f"{label}.db")
+            setup_database(db_path)
+            report(label, asyncio.run(runner(n, db_path)))
+
+
+if __name__ == '__main__':
+    main()
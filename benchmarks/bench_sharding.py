@@ -0,0 +1,95 @@
+# Discrete-event simulation of time-to-accept with every order posted to one runner
+# group versus routed per pickup zone through routing.OrderRouter.
+#
+# Runners live in one zone and only take orders picked up there. Each one checks
+# their feed now and then and reads every unread message before acting, so in the
+# single group they wade through the other zones' orders first. A runner who
+# accepts is busy for the delivery time.
+#
+#   python benchmarks/bench_sharding.py [orders_per_minute] [runners]
+import heapq
+import random
+import sys
+
+from common import percentile
+
+from routing import OrderRouter, ZONES
+
+SIM_MINUTES = 8 * 60
+CHECK_INTERVAL = 90.0    # mean seconds between feed checks
+READ_SECONDS = 3.0       # time to read one order message
+DELIVERY_SECONDS = 900.0 # mean time a runner is busy with an accepted order
+ZONE_WEIGHTS = (0.35, 0.35, 0.2, 0.1)
+
+
+def simulate(orders_per_minute, runners, sharded, seed=1):
+    rng = random.Random(seed)
+    home = {runner: rng.choices(ZONES, ZONE_WEIGHTS)[0] for runner in range(runners)}
+    router = OrderRouter('group', zone_chats={zone: zone for zone in ZONES})
+    for runner, zone in home.items():
+        router.subscribe(runner, zone)
+
+    # Each feed is an append-only list of (order_id, zone), runners keep a read offset
+    feeds = {}
+    feed_of = {runner: (home[runner] if sharded else 'group') for runner in range(runners)}
+    offsets = dict.fromkeys(range(runners), 0)
+    busy_until = dict.fromkeys(range(runners), 0.0)
+    posted_at, accepted_at = {}, {}
+
+    events = []
+    t, order_id = 0.0, 0
+    while t < SIM_MINUTES * 60:
+        t += rng.expovariate(orders_per_minute / 60)
+        zone = rng.choices(ZONES, ZONE_WEIGHTS)[0]
+        heapq.heappush(events, (t, 'order', order_id, zone))
+        order_id += 1
+    for runner in range(runners):
+        heapq.heappush(events, (rng.expovariate(1 / CHECK_INTERVAL), 'check', runner, None))
+
+    delivered = 0
+    while events:
+        now, kind, key, zone = heapq.heappop(events)
+        if now > SIM_MINUTES * 60 + 3600:
+            break
+        if kind == 'order':
+            chat = router.chat_for(zone) if sharded else 'group'
+            feeds.setdefault(chat, []).append((key, zone))
+            delivered += len(router.subscribers_for(zone)) if sharded else runners
+            posted_at[key] = now
+            continue
+
+        runner = key
+        feed = feeds.get(feed_of[runner], [])
+        clock = max(now, busy_until[runner])
+        while offsets[runner] < len(feed):
+            order, order_zone = feed[offsets[runner]]
+            offsets[runner] += 1
+            clock += READ_SECONDS
+            if order_zone == home[runner] and order not in accepted_at:
+                accepted_at[order] = clock
+                busy_until[runner] = clock + rng.expovariate(1 / DELIVERY_SECONDS)
+                break
+        heapq.heappush(events, (max(clock, busy_until[runner]) + rng.expovariate(1 / CHECK_INTERVAL), 'check', runner, None))
+
+    waits = [accepted_at[order] - posted_at[order] for order in accepted_at]
+    return {
+        'orders': len(posted_at),
+        'accepted': len(waits),
+        'p50': percentile(waits, 50),
+        'p95': percentile(waits, 95),
+        'messages per runner': delivered / runners,
+    }
+
+
+def main():
+    orders_per_minute = float(sys.argv[1]) if len(sys.argv) > 1 else 2.0
+    runners = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+    for label, sharded in (('single group', False), ('sharded', True)):
+        result = simulate(orders_per_minute, runners, sharded)
+        print(f"{label:<13} accepted {result['accepted']}/{result['orders']}  "
+              f"time-to-accept p50={result['p50']:6.1f}s p95={result['p95']:6.1f}s  "
+              f"messages per runner={result['messages per runner']:.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# Range scans and latency aggregation over Orders with the old text timestamps
+# versus epoch milliseconds.
+#
+#   python benchmarks/bench_timestamps.py [orders]
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+import common  # noqa: F401, puts the repository root on sys.path
+
+import database
+
+DAY_MS = 86400 * 1000
+START_MS = 1704067200000  # 2024-01-01 UTC
+
+QUERIES = {
+    'text': {
+        'day range count': (
+            "SELECT COUNT(*) FROM Orders WHERE status = 'accepted' AND order_time >= ? AND order_time < ?",
+            lambda day: (database.format_ms(START_MS + day * DAY_MS), database.format_ms(START_MS + (day + 1) * DAY_MS)),
+        ),
+        'day acceptance latency': (
+            "SELECT AVG((julianday(accept_time) - julianday(order_time)) * 86400) FROM Orders "
+            "WHERE status = 'accepted' AND order_time >= ? AND order_time < ?",
+            lambda day: (database.format_ms(START_MS + day * DAY_MS), database.format_ms(START_MS + (day + 1) * DAY_MS)),
+        ),
+    },
+    'epoch ms': {
+        'day range count': (
+            "SELECT COUNT(*) FROM Orders WHERE status = 'accepted' AND order_time >= ? AND order_time < ?",
+            lambda day: (START_MS + day * DAY_MS, START_MS + (day + 1) * DAY_MS),
+        ),
+        'day acceptance latency': (
+            "SELECT AVG((accept_time - order_time) / 1000.0) FROM Orders "
+            "WHERE status = 'accepted' AND order_time >= ? AND order_time < ?",
+            lambda day: (START_MS + day * DAY_MS, START_MS + (day + 1) * DAY_MS),
+        ),
+    },
+}
+
+
+def populate(conn, orders, as_text):
+    rows = []
+    for i in range(orders):
+        order_time = START_MS + random.randrange(365 * DAY_MS)
+        accept_time = order_time + random.randrange(10_000, 600_000)
+        if as_text:
+            order_time, accept_time = database.format_ms(order_time), database.format_ms(accept_time)
+        rows.append((f"ORDER_{i}", i % 5000, 'food', 'Zubair', 'Ali', order_time, 'accepted', accept_time))
+    conn.executemany('''
+        INSERT INTO Orders (id, customer_id, delivery_type, from_location, to_location, order_time, status, accept_time)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    conn.commit()
+
+
+def measure(conn, sql, params, repeat=200):
+    start = time.perf_counter()
+    for day in range(repeat):
+        conn.execute(sql, params(day % 365)).fetchone()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    orders = int(sys.argv[1]) if len(sys.argv) > 1 else 300000
+    with tempfile.TemporaryDirectory() as tmp:
+        # Old layout: the original tables and indexes, before migration 4
+        old = sqlite3.connect(os.path.join(tmp, 'text.db'))
+        database.create_base_tables(old.cursor())
+        database.add_order_indexes(old.cursor())
+        populate(old, orders, as_text=True)
+
+        new_path = os.path.join(tmp, 'ms.db')
+        database.setup_database(new_path)
+        new = database.connect(new_path)
+        populate(new, orders, as_text=False)
+
+        for label, conn in (('text', old), ('epoch ms', new)):
+            for name, (sql, params) in QUERIES[label].items():
+                print(f"{label:<9} {name:<24} {measure(conn, sql, params) * 1000:7.3f} ms")
+        old.close()
+        new.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+# Webhook against long polling, timed the way a user sees it: from handing the bot a
+# /start update until its reply reaches the Bot API. Each mode starts workers.py against
+# fake_bot_api.py. In webhook mode updates are POSTed to the bot's webhook with the
+# secret header; in polling mode they are queued for getUpdates. The webhook run also
+# reports how long the bot took to answer the POST itself.
+#
+#   python benchmarks/bench_webhook.py --updates 2000 --concurrency 50
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import tempfile
+import time
+
+import httpx
+
+from common import percentile
+from check_workers import start_workers
+from fake_bot_api import FakeBotAPI
+
+SECRET = 'bench-secret'
+REPLY_TIMEOUT = 30
+READY_TIMEOUT = 30
+FIRST_USER = 2_000_000
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def replied_to(user_id):
+    return lambda method, chat_id, message: method == 'sendMessage' and chat_id == user_id
+
+
+# Hand one /start to the bot and wait for its reply. Returns (reply seconds, POST
+# seconds or None when polling).
+async def round_trip(api, client, webhook_url, user_id):
+    update = api.text_update(user_id, '/start')
+    index = len(api.events)
+    started = time.perf_counter()
+    posted = None
+    if webhook_url:
+        response = await client.post(webhook_url, json=update, headers={'X-Telegram-Bot-Api-Secret-Token': SECRET})
+        response.raise_for_status()
+        posted = time.perf_counter() - started
+    else:
+        await api.push(update)
+    await api.wait_for(replied_to(user_id), index, REPLY_TIMEOUT)
+    return time.perf_counter() - started, posted
+
+
+# Retry a first update until the bot answers it, the webhook server comes up after
+# the process starts
+async def wait_ready(api, client, webhook_url):
+    deadline = time.perf_counter() + READY_TIMEOUT
+    while True:
+        try:
+            await round_trip(api, client, webhook_url, FIRST_USER - 1)
+            return
+        except (httpx.HTTPError, asyncio.TimeoutError):
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def run(args, mode):
+    api = await FakeBotAPI(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000).start()
+    env = {}
+    webhook_url = None
+    if mode == 'webhook':
+        port = free_port()
+        env = {
+            'WEBHOOK_URL': f"http://127.0.0.1:{port}",
+            'WEBHOOK_SECRET': SECRET,
+            'WEBHOOK_LISTEN': '127.0.0.1',
+            'WEBHOOK_PORT': str(port),
+        }
+        webhook_url = f"http://127.0.0.1:{port}/telegram"
+
+    replies, posts = [], []
+    failed = 0
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def one(client, user_id):
+        nonlocal failed
+        async with slots:
+            try:
+                reply, posted = await round_trip(api, client, webhook_url, user_id)
+            except (httpx.HTTPError, asyncio.TimeoutError):
+                failed += 1
+                return
+            replies.append(reply)
+            if posted is not None:
+                posts.append(posted)
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=REPLY_TIMEOUT) as client:
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, 'workers.out'), 'w') as out:
+                process = await start_workers(api, tmp, args.workers, out, **env)
+                try:
+                    await wait_ready(api, client, webhook_url)
+                    started = time.perf_counter()
+                    await asyncio.gather(*(one(client, FIRST_USER + i) for i in range(args.updates)))
+                    elapsed = time.perf_counter() - started
+                finally:
+                    process.send_signal(signal.SIGINT)
+                    await process.wait()
+    await api.stop()
+    return replies, posts, failed, elapsed
+
+
+def report(mode, replies, posts, failed, elapsed):
+    print(f"{mode:<8} {len(replies)} updates in {elapsed:.2f}s ({len(replies) / elapsed:,.0f} replies/s), {failed} failed")
+    rows = [('reply', replies)] + ([('HTTP 200', posts)] if posts else [])
+    for name, samples in rows:
+        print(f"  {name:<9} p50={percentile(samples, 50) * 1000:8.1f} ms  "
+              f"p95={percentile(samples, 95) * 1000:8.1f} ms  p99={percentile(samples, 99) * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Webhook against long polling, update to reply, on the fake Bot API.")
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50, help="updates in flight at once")
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--latency-ms', type=float, default=20, help="fake Bot API latency per call")
+    parser.add_argument('--jitter-ms', type=float, default=10)
+    parser.add_argument('--mode', choices=('webhook', 'polling', 'both'), default='both')
+    args = parser.parse_args()
+
+    for mode in ('webhook', 'polling') if args.mode == 'both' else (args.mode,):
+        report(mode, *asyncio.run(run(args, mode)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+# Metrics endpoint check: serves bot.refresh_gauges() through start_metrics_server on a
+# temporary database, scrapes /metrics over HTTP and parses every line of the
+# exposition. Fails on malformed lines, samples outside a declared family, broken
+# histograms, missing component stats, or an order gauge that keeps a stale count once its
+# status empties.
+#
+#   python benchmarks/check_metrics.py
+import asyncio
+import math
+import os
+import re
+import sys
+import tempfile
+
+import common  # noqa: F401, puts the repository root on sys.path
+
+import bot
+from database import now_ms, setup_database
+from metrics import HANDLER_SECONDS, THROTTLED_UPDATES, start_metrics_server
+from repository import Repository, cancel_order, ensure_customer, insert_order
+
+SAMPLE_LINE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})? (\S+)$')
+LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"(?:,|$)')
+HISTOGRAM_SUFFIXES = ('_bucket', '_sum', '_count')
+# Gauges refresh_gauges fills from the components' stats on every scrape
+STATS_FAMILIES = ('makanapa_database', 'makanapa_persistence', 'makanapa_page_cache',
+                  'makanapa_outbound_calls', 'makanapa_outbound_wait_seconds')
+
+
+# GET a path from the metrics server, returns (status code, body)
+async def scrape(port, path='/metrics'):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode())
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), body.decode()
+
+
+def parse_labels(text):
+    labels, position = {}, 0
+    while position < len(text):
+        match = LABEL.match(text, position)
+        if not match:
+            raise ValueError(f"bad labels {text!r}")
+        labels[match.group(1)] = match.group(2)
+        position = match.end()
+    return labels
+
+
+# {family: kind} and [(sample name, labels, value)] from Prometheus text exposition,
+# raising ValueError on anything that does not parse
+def parse(text):
+    kinds, samples = {}, []
+    for line in text.splitlines():
+        if not line:
+            continue
+        if line.startswith('# TYPE '):
+            _, _, name, kind = line.split(' ', 3)
+            kinds[name] = kind
+        elif line.startswith('# HELP '):
+            continue
+        else:
+            match = SAMPLE_LINE.match(line)
+            if not match:
+                raise ValueError(f"bad sample line {line!r}")
+            name, labels, value = match.groups()
+            family = name
+            if name not in kinds and name.endswith(HISTOGRAM_SUFFIXES):
+                family = name.rsplit('_', 1)[0]
+            if kinds.get(family) is None:
+                raise ValueError(f"sample {name} has no # TYPE before it")
+            samples.append((name, parse_labels(labels or ''), float(value)))
+    return kinds, samples
+
+
+# Buckets must be cumulative and end in +Inf equal to _count
+def check_histograms(kinds, samples):
+    problems = []
+    for family in (name for name, kind in kinds.items() if kind == 'histogram'):
+        series = {}
+        for name, labels, value in samples:
+            if name.startswith(family):
+                key = tuple(sorted((k, v) for k, v in labels.items() if k != 'le'))
+                series.setdefault(key, {'buckets': [], 'count': None})
+                if name == f'{family}_bucket':
+                    le = labels['le']
+                    series[key]['buckets'].append((math.inf if le == '+Inf' else float(le), value))
+                elif name == f'{family}_count':
+                    series[key]['count'] = value
+        for key, found in series.items():
+            counts = [count for _, count in sorted(found['buckets'])]
+            if counts != sorted(counts):
+                problems.append(f"{family}{dict(key)}: buckets are not cumulative")
+            if not found['buckets'] or sorted(found['buckets'])[-1] != (math.inf, found['count']):
+                problems.append(f"{family}{dict(key)}: +Inf bucket does not match _count")
+    return problems
+
+
+def order_gauges(samples):
+    return {labels['status']: value for name, labels, value in samples if name == 'makanapa_orders'}
+
+
+async def main():
+    problems = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'makanApa.db')
+        setup_database(db_path)
+        bot.repo = Repository(db_path)
+        await bot.repo.run(ensure_customer, 1, 'customer')
+        await bot.repo.run(insert_order, 'ORDER_CHECK', 1, 'food', 'Library', 'KICT', now_ms())
+        HANDLER_SECONDS.observe(0.003, handler='check')
+        HANDLER_SECONDS.observe(7.0, handler='check')
+        THROTTLED_UPDATES.inc()
+
+        server = await start_metrics_server(bot.refresh_gauges, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            status, body = await scrape(port)
+            if status != 200:
+                problems.append(f"/metrics answered {status}")
+            kinds, samples = parse(body)
+            problems += check_histograms(kinds, samples)
+            exported = {name for name, _, _ in samples}
+            problems += [f"{family} has no samples" for family in STATS_FAMILIES if family not in exported]
+            before = order_gauges(samples)
+            if before != {'pending': 1, 'accepted': 0, 'cancelled': 0, 'expired': 0}:
+                problems.append(f"orders by status with one pending order: {before}")
+
+            # The only pending order goes away, its gauge must drop to 0
+            await bot.repo.run(cancel_order, 'ORDER_CHECK', now_ms())
+            _, body = await scrape(port)
+            after = order_gauges(parse(body)[1])
+            if after != {'pending': 0, 'accepted': 0, 'cancelled': 1, 'expired': 0}:
+                problems.append(f"orders by status after cancelling it: {after}")
+
+            status, _ = await scrape(port, '/other')
+            if status != 404:
+                problems.append(f"/other answered {status}")
+            print(f"Scraped {len(samples)} samples in {len(kinds)} families.")
+        finally:
+            server.close()
+            await server.wait_closed()
+            bot.repo.close()
+
+    if problems:
+        sys.exit('\n'.join(problems))
+    print("Metrics exposition parses and order gauges follow the database.")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,30 @@
+# Fails if any hot query in database.HOT_QUERIES would scan a table or a whole index
+# instead of searching one.
+#
+#   python benchmarks/check_query_plans.py [db_path]
+import os
+import sys
+import tempfile
+
+import common  # noqa: F401, puts the repository root on sys.path
+
+from database import check_query_plans, connect, setup_database
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(tmp, 'plans.db')
+        setup_database(db_path)
+        conn = connect(db_path)
+        regressions = check_query_plans(conn)
+        conn.close()
+
+    for name, detail in regressions:
+        print(f"{name}: {detail}")
+    if regressions:
+        sys.exit(1)
+    print("All hot queries search an index.")
+
+
+if __name__ == '__main__':
+    main()
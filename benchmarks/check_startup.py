@@ -0,0 +1,76 @@
+# Cold-start budget check: starts bot.py against the fake Bot API in a fresh directory,
+# once with no database (every migration runs) and once on the database that run left,
+# and fails if either takes longer than the budget to poll for its first updates. The
+# bot's own breakdown by phase comes from the "Started in" line it logs.
+#
+#   python benchmarks/check_startup.py [budget seconds]
+import asyncio
+import json
+import os
+import signal
+import sys
+import tempfile
+import time
+
+from common import ROOT
+from fake_bot_api import FakeBotAPI
+
+DEFAULT_BUDGET = 2.0  # seconds from process start to the first getUpdates
+READY_TIMEOUT = 30
+
+
+# Seconds from starting bot.py until it asks for updates, and its startup log line
+async def cold_start(api, tmp):
+    env = {
+        **os.environ,
+        'BOT_TOKEN': '1:fake',
+        'BOT_API_URL': api.url,
+        'RUNNER_GROUP_ID': '-100',
+        'METRICS_PORT': str(api.port + 1),
+    }
+    polls = api.calls.get('getUpdates', 0)
+    started = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(ROOT, 'bot.py'),
+        cwd=tmp, env=env, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+    )
+    try:
+        while api.calls.get('getUpdates', 0) == polls:
+            if process.returncode is not None or time.perf_counter() - started > READY_TIMEOUT:
+                sys.exit(f"bot.py did not start, see {tmp}/data/bot.log")
+            await asyncio.sleep(0.005)
+        elapsed = time.perf_counter() - started
+    finally:
+        process.send_signal(signal.SIGINT)
+        await process.wait()
+
+    # The log is flushed on shutdown, the last startup line is this run's
+    summary = None
+    with open(os.path.join(tmp, 'data', 'bot.log')) as f:
+        for line in f:
+            message = json.loads(line)['message']
+            if message.startswith('Started in'):
+                summary = message
+    return elapsed, summary
+
+
+async def main():
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_BUDGET
+    api = await FakeBotAPI().start()
+    over = []
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(os.path.join(tmp, 'data'))
+        for run in ('new database', 'existing database'):
+            elapsed, summary = await cold_start(api, tmp)
+            print(f"{run:<18} ready in {elapsed * 1000:.0f} ms: {summary}")
+            if elapsed > budget:
+                over.append(run)
+    await api.stop()
+
+    if over:
+        sys.exit(f"Over the {budget:.1f}s cold-start budget: {', '.join(over)}")
+    print(f"Within the {budget:.1f}s cold-start budget.")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
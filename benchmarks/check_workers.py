@@ -0,0 +1,168 @@
+# Integration check for workers.py: runs several worker processes against the fake Bot
+# API, walks many customers through /start -> confirm, has runners accept every order
+# while some customers cancel at the same moment, then checks that no order was lost,
+# duplicated or both accepted and cancelled.
+#
+#   python benchmarks/check_workers.py [workers] [customers]
+import asyncio
+import collections
+import os
+import random
+import re
+import signal
+import sqlite3
+import sys
+import tempfile
+import time
+
+from common import ROOT
+from fake_bot_api import FakeBotAPI, buttons
+
+RUNNER_GROUP_ID = -100
+RUNNERS = [900000 + i for i in range(5)]
+CANCEL_EVERY = 3  # every third customer tries to cancel while a runner accepts
+
+
+# Walk a customer from /start to a confirmed order. Returns the order ID, the customer's
+# order message and the event index it was found at. With `timings`, the seconds from
+# each action to the bot's reply are appended per stage.
+async def place_order(api, user_id, timings=None):
+    async def step(stage, action, predicate, since):
+        started = time.perf_counter()
+        await action
+        index, (_, _, message) = await api.wait_for(lambda m, c, msg: c == user_id and predicate(msg), since)
+        if timings is not None:
+            timings.setdefault(stage, []).append(time.perf_counter() - started)
+        return index, message
+
+    index, message = await step('start', api.send_text(user_id, '/start'),
+                                lambda msg: 'food' in buttons(msg), len(api.events))
+    index, message = await step('delivery type', api.click(user_id, message, 'food'),
+                                lambda msg: 'in_uia' in buttons(msg), index + 1)
+    index, _ = await step('pickup zone', api.click(user_id, message, 'in_uia'),
+                          lambda msg: 'type the PICKUP' in msg['text'], index + 1)
+    index, message = await step('pickup location', api.send_text(user_id, 'Library'),
+                                lambda msg: 'to_in_uia' in buttons(msg), index + 1)
+    index, _ = await step('delivery zone', api.click(user_id, message, 'to_in_uia'),
+                          lambda msg: 'type the DELIVERY' in msg['text'], index + 1)
+    index, message = await step('delivery location', api.send_text(user_id, 'KICT'),
+                                lambda msg: 'confirm' in buttons(msg), index + 1)
+    index, message = await step('confirm', api.click(user_id, message, 'confirm'),
+                                lambda msg: 'Order ID: #' in msg['text'], index + 1)
+    return re.search(r'Order ID: #(\S+)', message['text']).group(1), message, index
+
+
+async def customer(api, user_id, cancels):
+    order_id, customer_message, index = await place_order(api, user_id)
+    post = await api.wait_for_button(f"accept_{order_id}")
+    runner = random.choice(RUNNERS)
+    await asyncio.gather(
+        api.click(runner, post, f"accept_{order_id}"),
+        api.click(user_id, customer_message, f"cancel_{order_id}") if cancels else asyncio.sleep(0),
+    )
+    # Resolved when the runner got the order or was told it is gone
+    await api.wait_for(lambda m, c, msg: (
+        (c == runner and f"accepted the order #{order_id}" in msg['text'])
+        or (m == 'answerCallbackQuery' and c == runner and f"#{order_id} is no longer available" in msg['text'])
+    ), index)
+    if cancels:
+        await api.wait_for(lambda m, c, msg: c == user_id and 'cancel' in msg['text'] and 'Order ID' not in msg['text'], index)
+    return order_id
+
+
+# Start workers.py against the fake API in `tmp`, which gets its own data/ directory
+async def start_workers(api, tmp, workers, out, **env):
+    os.makedirs(os.path.join(tmp, 'data'), exist_ok=True)
+    env = {
+        **os.environ,
+        'BOT_TOKEN': '1:fake',
+        'BOT_API_URL': api.url,
+        'RUNNER_GROUP_ID': str(RUNNER_GROUP_ID),
+        'CHAT_RATE_PER_MINUTE': '1000000',
+        # A handful of runners accept every order, far faster than real ones would
+        'USER_RATE_PER_MINUTE': '1000000',
+        'METRICS_PORT': str(api.port + 1),
+        'LOG_LEVEL': 'WARNING',
+        **env,
+    }
+    return await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(ROOT, 'workers.py'), '--workers', str(workers),
+        cwd=tmp, env=env, stdout=out, stderr=out
+    )
+
+
+def verify(api, db_path, order_ids, customers):
+    problems = []
+    conn = sqlite3.connect(db_path)
+    statuses = dict(conn.execute("SELECT id, status FROM Orders"))
+    conn.close()
+
+    if len(order_ids) != customers or len(set(order_ids)) != customers:
+        problems.append(f"customers {customers}, orders seen {len(order_ids)}, distinct {len(set(order_ids))}")
+    if len(statuses) != customers:
+        problems.append(f"{len(statuses)} orders in the database for {customers} customers")
+
+    posts = collections.Counter()
+    accepted_dms = collections.Counter()
+    cancel_confirmations = collections.Counter()
+    for method, chat_id, message in api.events:
+        text = message['text']
+        found = re.search(r'#(ORDER_\w+)', text)
+        if not found:
+            continue
+        order_id = found.group(1)
+        if method == 'sendMessage' and chat_id == RUNNER_GROUP_ID and text.startswith('🆕'):
+            posts[order_id] += 1
+        elif method == 'sendMessage' and chat_id in RUNNERS and 'You have accepted' in text:
+            accepted_dms[order_id] += 1
+        elif method == 'editMessageText' and chat_id == RUNNER_GROUP_ID and 'cancelled by the user' in text:
+            cancel_confirmations[order_id] += 1
+
+    for order_id, status in statuses.items():
+        if posts[order_id] != 1:
+            problems.append(f"{order_id}: posted {posts[order_id]} times")
+        expected = (1, 0) if status == 'accepted' else (0, 1) if status == 'cancelled' else None
+        if expected is None:
+            problems.append(f"{order_id}: left {status}")
+        elif (accepted_dms[order_id], cancel_confirmations[order_id]) != expected:
+            problems.append(f"{order_id}: {status} but {accepted_dms[order_id]} runner DMs, "
+                            f"{cancel_confirmations[order_id]} cancel edits")
+    return statuses, problems
+
+
+async def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    customers = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    api = await FakeBotAPI().start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, 'workers.out'), 'w') as out:
+            process = await start_workers(api, tmp, workers, out)
+            try:
+                started = time.perf_counter()
+                order_ids = await asyncio.gather(*(
+                    customer(api, 10000 + i, i % CANCEL_EVERY == 0) for i in range(customers)
+                ))
+                elapsed = time.perf_counter() - started
+            finally:
+                process.send_signal(signal.SIGINT)
+                await process.wait()
+        await api.stop()
+
+        statuses, problems = verify(api, os.path.join(tmp, 'data', 'makanApa.db'), order_ids, customers)
+        if problems:
+            with open(os.path.join(tmp, 'workers.out')) as f:
+                print(f.read()[-4000:])
+
+    counts = collections.Counter(statuses.values())
+    print(f"{workers} workers, {customers} customers in {elapsed:.1f}s ({customers / elapsed:.1f} orders/s): "
+          f"{counts['accepted']} accepted, {counts['cancelled']} cancelled")
+    for problem in problems[:20]:
+        print(problem)
+    if problems:
+        sys.exit(1)
+    print("No lost, duplicated or double-resolved orders.")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
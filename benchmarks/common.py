@@ -0,0 +1,15 @@
+# Shared by the benchmark and check scripts. Importing it puts the repository root on
+# sys.path, so the bot's own modules import from a script run as
+# `python benchmarks/<script>.py`.
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+# Nearest-rank percentile, pct from 0 to 100
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
@@ -0,0 +1,237 @@
+# In-process stand-in for the Telegram Bot API, enough for bot.py: getMe, getUpdates,
+# sendMessage, editMessageText, deleteMessage and answerCallbackQuery. Point the bot at
+# it with BOT_API_URL=http://127.0.0.1:<port>. Scripts inject user updates with
+# send_text()/click() (or build one with text_update() to POST to a webhook) and wait
+# for the bot's replies with wait_for().
+#
+# Every method except getUpdates can be slowed down by `latency` seconds (plus up to
+# `jitter`), and a `flood_ratio` share of the flood_methods calls is answered with
+# 429 Too Many Requests and retry_after, like Telegram's flood control.
+import asyncio
+import itertools
+import json
+import logging
+import random
+import time
+
+import tornado.httpserver
+import tornado.netutil
+import tornado.web
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'makanApa', 'username': 'makanapa_bot'}
+FLOOD_METHODS = ('sendMessage', 'editMessageText')
+
+# Injected 429s would otherwise be logged as access warnings
+logging.getLogger('tornado.access').setLevel(logging.ERROR)
+
+
+def _chat(chat_id):
+    return {'id': chat_id, 'type': 'private' if chat_id > 0 else 'supergroup'}
+
+# Form values arrive JSON encoded except plain strings
+def _decode(value):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+class _MethodHandler(tornado.web.RequestHandler):
+    def initialize(self, api):
+        self.api = api
+
+    async def post(self, token, method):
+        params = {name: _decode(self.get_body_argument(name)) for name in self.request.body_arguments}
+        handler = getattr(self.api, f"api_{method}", None)
+        if handler is None:
+            self.set_status(404)
+            self.write({'ok': False, 'error_code': 404, 'description': 'Not Found: method not found'})
+            return
+        api = self.api
+        api.calls[method] = api.calls.get(method, 0) + 1
+        if method != 'getUpdates' and (api.latency or api.jitter):
+            await asyncio.sleep(api.latency + random.random() * api.jitter)
+        if method in api.flood_methods and api.flood_ratio and random.random() < api.flood_ratio:
+            api.calls['429'] = api.calls.get('429', 0) + 1
+            self.set_status(429)
+            self.write({
+                'ok': False,
+                'error_code': 429,
+                'description': f"Too Many Requests: retry after {api.retry_after}",
+                'parameters': {'retry_after': api.retry_after},
+            })
+            return
+        self.write({'ok': True, 'result': await handler(params)})
+
+
+class FakeBotAPI:
+    def __init__(self, latency=0.0, jitter=0.0, flood_ratio=0.0, retry_after=1, flood_methods=FLOOD_METHODS):
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_ratio = flood_ratio
+        self.retry_after = retry_after
+        self.flood_methods = flood_methods
+        self.updates = []
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.messages = {}
+        self.events = []      # (method, chat_id, message) for every message the bot sent or edited
+        self.by_button = {}   # callback data -> latest message carrying that button
+        self.callback_queries = {}   # unanswered callback query ID -> user who clicked
+        self.calls = {}
+        self._changed = asyncio.Condition()
+        self._server = None
+        self._closed = False
+
+    async def start(self, port=0):
+        app = tornado.web.Application([(r"/bot([^/]+)/(\w+)", _MethodHandler, {'api': self})])
+        sockets = tornado.netutil.bind_sockets(port, '127.0.0.1')
+        self._server = tornado.httpserver.HTTPServer(app)
+        self._server.add_sockets(sockets)
+        self.port = sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+        return self
+
+    async def stop(self):
+        self._closed = True
+        await self._notify()
+        # Let the long polls woken above answer before their connections are closed
+        await asyncio.sleep(0.1)
+        self._server.stop()
+        await self._server.close_all_connections()
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    # Wait until some event from index `since` on matches, returns (index, event)
+    async def wait_for(self, predicate, since=0, timeout=30):
+        async def find():
+            index = since
+            async with self._changed:
+                while True:
+                    while index < len(self.events):
+                        if predicate(*self.events[index]):
+                            return index, self.events[index]
+                        index += 1
+                    await self._changed.wait()
+        return await asyncio.wait_for(find(), timeout)
+
+    # Wait for the bot to show a button with this callback data, returns its message
+    async def wait_for_button(self, data, timeout=30):
+        async def find():
+            async with self._changed:
+                await self._changed.wait_for(lambda: data in self.by_button)
+                return self.by_button[data]
+        return await asyncio.wait_for(find(), timeout)
+
+    def _record(self, method, chat_id, message):
+        self.messages[(chat_id, message['message_id'])] = message
+        self.events.append((method, chat_id, message))
+        for data in buttons(message):
+            self.by_button[data] = message
+
+    # Updates a user would produce
+
+    async def _push(self, **update):
+        await self.push(dict(update, update_id=next(self.update_ids)))
+
+    # Queue an update for getUpdates
+    async def push(self, update):
+        self.updates.append(update)
+        await self._notify()
+
+    # A message update from a user, as getUpdates or a webhook would deliver it
+    def text_update(self, user_id, text, username=None):
+        message = {
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': _chat(user_id),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f"user{user_id}", 'username': username or f"user{user_id}"},
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return {'update_id': next(self.update_ids), 'message': message}
+
+    async def send_text(self, user_id, text, username=None):
+        await self.push(self.text_update(user_id, text, username))
+
+    async def click(self, user_id, message, data, username=None):
+        query_id = str(next(self.update_ids))
+        self.callback_queries[query_id] = user_id
+        await self._push(callback_query={
+            'id': query_id,
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f"user{user_id}", 'username': username or f"user{user_id}"},
+            'chat_instance': str(message['chat']['id']),
+            'message': message,
+            'data': data,
+        })
+
+    # Bot API methods
+
+    async def api_getMe(self, params):
+        return BOT_USER
+
+    async def api_deleteWebhook(self, params):
+        return True
+
+    async def api_setWebhook(self, params):
+        return True
+
+    async def api_getUpdates(self, params):
+        offset = params.get('offset', 0)
+        self.updates = [update for update in self.updates if update['update_id'] >= offset]
+        if not self.updates and params.get('timeout'):
+            try:
+                async with self._changed:
+                    await asyncio.wait_for(self._changed.wait_for(lambda: self.updates or self._closed), params['timeout'])
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:params.get('limit', 100)]
+
+    async def api_sendMessage(self, params):
+        chat_id = params['chat_id']
+        message = {
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': _chat(chat_id),
+            'from': BOT_USER,
+            'text': params['text'],
+        }
+        if params.get('reply_markup'):
+            message['reply_markup'] = params['reply_markup']
+        self._record('sendMessage', chat_id, message)
+        await self._notify()
+        return message
+
+    async def api_editMessageText(self, params):
+        chat_id = params['chat_id']
+        message = dict(self.messages.get((chat_id, params['message_id'])) or {
+            'message_id': params['message_id'], 'date': int(time.time()), 'chat': _chat(chat_id), 'from': BOT_USER,
+        })
+        message['text'] = params['text']
+        message.pop('reply_markup', None)
+        if params.get('reply_markup'):
+            message['reply_markup'] = params['reply_markup']
+        self._record('editMessageText', chat_id, message)
+        await self._notify()
+        return message
+
+    async def api_deleteMessage(self, params):
+        self.messages.pop((params['chat_id'], params['message_id']), None)
+        return True
+
+    # Answers with text (alerts and toasts) show up in events under the clicking user
+    async def api_answerCallbackQuery(self, params):
+        user_id = self.callback_queries.pop(str(params['callback_query_id']), None)
+        if params.get('text'):
+            self.events.append(('answerCallbackQuery', user_id, {'text': params['text']}))
+            await self._notify()
+        return True
+
+
+# Callback data of every inline button on a message
+def buttons(message):
+    markup = message.get('reply_markup') or {}
+    return [button.get('callback_data') for row in markup.get('inline_keyboard', []) for button in row]
@@ -1,4 +1,8 @@
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+# Imported first, it starts the startup clock
+from startup import timer as startup
+
+from telegram import ChatMember, Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import TelegramError
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -6,31 +10,46 @@ from telegram.ext import (
     MessageHandler,
     filters,
     CallbackContext,
-    ConversationHandler
+    ConversationHandler,
+    ApplicationHandlerStop,
+    TypeHandler
 )
 from typing import Final
+import asyncio
 from datetime import datetime
-import json
-import sqlite3
+from functools import partial
+import gc
 import os
 import logging
+import sys
 
+from dotenv import load_dotenv
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("data/bot.log"),
-        logging.StreamHandler()
-    ]
+# Before the local imports: notifications, ratelimit, metrics, logging_setup and archive
+# read their settings from the environment when imported
+load_dotenv()
+
+from archive import ARCHIVE_AFTER_DAYS, archive_batch, vacuum_step
+from auth import Authorizer, BLOCKED, NOT_AUTHORIZED
+from database import SCHEMA_VERSION, format_ms, now_ms, setup_database
+from history import PAGE_SIZE, ROLES, STATUS_LABELS, PageCache, page_button_data, parse_page_button
+from locations import LocationIndex
+from logging_setup import setup_logging, stop_logging
+from metrics import (
+    AUTH_CACHE, DATABASE, METRICS_PORT, ORDERS, OUTBOUND_CALLS, OUTBOUND_DEPTH, OUTBOUND_WAIT, PAGE_CACHE, PERSISTENCE,
+    STARTUP_SECONDS, THROTTLED_UPDATES, instrumented_request, start_metrics_server, timed_handler
 )
-logger = logging.getLogger(__name__) # Get logger instance
-logger.setLevel(logging.DEBUG) # Set logger level to DEBUG to capture debug logs as well
+from notifications import CHAT_RATE, OutboundQueue, dispatch, PRIORITY_COSMETIC, PRIORITY_NEW_ORDER, PRIORITY_STATUS
+from persistence import CONVERSATION_TTL, SQLitePersistence
+from ratelimit import ALLOWED, MAX_PENDING_ORDERS, THROTTLED, UserRateLimiter
+from repository import Repository
+from routing import OrderRouter, ZONES, ZONE_NAMES
 
-from dotenv import load_dotenv
 
-load_dotenv()
+# Logging goes through a background queue, configured in main() (level from LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+startup.end('imports')
 
 # Define states for the conversation
 (
@@ -41,66 +60,136 @@ load_dotenv()
     CHOOSING_TO_CATEGORY,
     CHOOSING_TO_MAHALLAH,
     TYPING_TO_LOCATION,
-    CONFIRMING_ORDER
-) = range(8)
+    CONFIRMING_ORDER,
+    CHOOSING_FROM_MATCH,
+    CHOOSING_TO_MATCH
+) = range(10)
 
 # Constants
 BOT_TOKEN: Final = os.getenv('BOT_TOKEN')
 RUNNER_GROUP_ID: Final = os.getenv('RUNNER_GROUP_ID')
-ORDERS_FILE = 'data/order_counter.json'
+PENDING_ORDER_TTL: Final = int(os.getenv('PENDING_ORDER_TTL', '1800'))
+EXPIRY_SWEEP_INTERVAL: Final = int(os.getenv('EXPIRY_SWEEP_INTERVAL', '60'))
+EXPIRY_BATCH_SIZE = 200
+WEBHOOK_URL: Final = os.getenv('WEBHOOK_URL')
+WEBHOOK_SECRET: Final = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_LISTEN: Final = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT: Final = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH: Final = os.getenv('WEBHOOK_PATH', 'telegram')
+# Bot API server, e.g. a local fake one for load tests
+BOT_API_URL: Final = os.getenv('BOT_API_URL', 'https://api.telegram.org')
+# Worker processes sharing the database, set by workers.py
+WORKERS: Final = int(os.getenv('BOT_WORKERS', '1'))
+# Users allowed to /block and /unblock customers, e.g. ADMIN_IDS=123,456
+ADMIN_IDS: Final = {int(user_id) for user_id in os.getenv('ADMIN_IDS', '').split(',') if user_id.strip()}
+# Chat member statuses that count as a runner for /subscribe
+RUNNER_STATUSES: Final = (ChatMember.MEMBER, ChatMember.ADMINISTRATOR, ChatMember.OWNER)
+SUBSCRIPTION_REFRESH_INTERVAL = 30
+CONCURRENT_UPDATES = 64   # updates handled at once, each user's still one at a time
+ARCHIVE_INTERVAL = 6 * 60 * 60   # seconds between archive runs
+IDLE_USER_SWEEP_INTERVAL = 10 * 60   # seconds between drops of idle users' user_data
 SISTER_MAHALLAHS = ["Safiyyah", "Ruqayyah", "Sumayyah", "Asiah", "Aminah", "Halimah", "Salahudin", "Maryam", "Nusaibah", "Hafsah"]
 BROTHER_MAHALLAHS = ["Zubair", "Ali", "Siddiq", "Uthman", "Farouq", "Bilal", "Salahudin"]
 
-# Database connection
-def get_db_connection():
-    conn = sqlite3.connect('data/makanApa.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+# Database access, all queries run off the event loop
+repo = Repository()
+authorizer = Authorizer(repo)
 
-# Get next order counter
-def get_next_counter():
-    logger.debug(f"Reading order counter from {ORDERS_FILE}")
-    try:
-        with open(ORDERS_FILE, 'r') as f:
-            counter = json.load(f)
-    except FileNotFoundError:
-        counter = {"count": 0}
-    counter["count"] += 1
-    logger.debug(f"Writing updated order counter to {ORDERS_FILE}: {counter}")
-    with open(ORDERS_FILE, 'w') as f:
-        json.dump(counter, f)
-    return counter["count"]
+# Conversation states and user_data, written back to the database in batches
+persistence = SQLitePersistence(repo)
 
-# Start command handler
-import os
-import json
+# Throttled sender for everything posted to the runner chats. Every worker posts to the
+# same chats, so each gets an equal share of Telegram's per-chat limit.
+outbox = OutboundQueue(rate=CHAT_RATE / WORKERS)
+
+# Zone channels and runner subscriptions for new orders, RUNNER_GROUP_ID is the fallback
+router = OrderRouter(RUNNER_GROUP_ID)
+
+# Per-user token buckets checked before any handler runs
+limiter = UserRateLimiter()
+
+# Recently shown /myorders and /runs pages, dropped when one of their orders changes status
+page_cache = PageCache()
 
+# Known locations for suggesting matches to typed ones, loaded in post_init
+location_index = LocationIndex()
+
+# Every runner-side message of an order: the channel post plus the subscriber copies.
+# Orders from before zone routing have no runner_chat_id and live in RUNNER_GROUP_ID.
+def runner_messages(order, copies):
+    messages = []
+    if order['runner_message_id']:
+        messages.append((order['runner_chat_id'] or router.default_chat_id, order['runner_message_id']))
+    return messages + copies
+
+# Send a Bot API call (a zero argument function returning the coroutine) to a chat. Runner
+# groups and channels go through the throttled outbox. Private chats (customers and
+# subscriber DMs) are called directly: they are not held to the group limit, and a lane
+# per private chat would pile up for good.
+def send_to(chat_id, call, priority):
+    if chat_id in router.runner_chats:
+        return outbox.send(chat_id, call, priority)
+    return call()
+
+# Edits of an order's runner-side messages, keyed for dispatch()
+def edit_runner_messages(context, order, copies, text, priority, action="edit runner message"):
+    return {
+        f"{action} in {chat_id}": send_to(chat_id, partial(
+            context.bot.edit_message_text,
+            chat_id=chat_id,
+            message_id=message_id,
+            text=text,
+            reply_markup=None
+        ), priority)
+        for chat_id, message_id in runner_messages(order, copies)
+    }
+
+# Handler group -1, ahead of the conversation: drops updates from users over their rate
+# before they reach the database or the Bot API. Only the first dropped update gets a
+# reply, the rest are ignored until the user's bucket refills.
+async def throttle(update: Update, context: CallbackContext) -> None:
+    user = update.effective_user
+    if user is None:
+        return
+    result = limiter.check(user.id)
+    if result == ALLOWED:
+        return
+    THROTTLED_UPDATES.inc()
+    if result == THROTTLED:
+        logger.warning("User %s is sending too fast, dropping updates.", user.id, extra={'user_id': user.id})
+        if update.callback_query:
+            await update.callback_query.answer("You're going too fast, please wait a moment.")
+        elif update.message and update.effective_chat.type == 'private':
+            await update.message.reply_text("You're going too fast, please wait a moment.")
+    raise ApplicationHandlerStop
+
+# Reply for customers who already have MAX_PENDING_ORDERS waiting for a runner
+TOO_MANY_PENDING = (
+    f"You already have {MAX_PENDING_ORDERS} orders waiting for a runner. "
+    "Please wait for one to be accepted or cancel one before placing another."
+)
+
+# Start command handler
+@timed_handler
 async def start(update: Update, context: CallbackContext) -> int:
     user_id = update.effective_user.id
-    logger.info(f"User {user_id} started the bot.")
-    devlist_path = 'data/devlist.json'
+    logger.info("User %s started the bot.", user_id, extra={'user_id': user_id})
 
-    if os.path.exists(devlist_path):
-        with open(devlist_path, 'r') as f:
-            devlist = json.load(f)
+    result = await authorizer.check(user_id)
+    if result == NOT_AUTHORIZED:
+        logger.warning("User %s is not authorized to use the bot.", user_id, extra={'user_id': user_id})
+        await update.message.reply_text("You are not authorized to use this bot.")
+        return ConversationHandler.END
+    if result == BLOCKED:
+        logger.warning("User %s is blocked from using the service.", user_id, extra={'user_id': user_id})
+        await update.message.reply_text("You have been blocked from using the service.")
+        return ConversationHandler.END
 
-        if user_id not in devlist:
-            logger.warning(f"User {user_id} is not authorized to use the bot.")
-            await update.message.reply_text("You are not authorized to use this bot.")
-            return ConversationHandler.END
-    else:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM Customers WHERE user_id=?", (user_id,))
-        customer = cursor.fetchone()
-        conn.close()
-
-        if customer and customer['is_blocked']:
-            logger.warning(f"User {user_id} is blocked from using the service.")
-            await update.message.reply_text("You have been blocked from using the service.")
-            return ConversationHandler.END
+    logger.info("User %s is authorized to use the bot.", user_id, extra={'user_id': user_id})
+    if await repo.count_pending_orders(user_id) >= MAX_PENDING_ORDERS:
+        await update.message.reply_text(TOO_MANY_PENDING)
+        return ConversationHandler.END
 
-    logger.info(f"User {user_id} is authorized to use the bot.")
     keyboard = [
         [InlineKeyboardButton("Food Delivery", callback_data='food')],
         [InlineKeyboardButton("Item Delivery", callback_data='item')]
@@ -112,21 +201,21 @@ async def start(update: Update, context: CallbackContext) -> int:
     )
     return CHOOSING_SERVICE
 
+# One button per location category. Pickup buttons carry the bare zone, delivery buttons
+# the same zone behind `to_`.
+def zone_keyboard(prefix: str = '') -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[InlineKeyboardButton(ZONE_NAMES[zone], callback_data=f"{prefix}{zone}")] for zone in ZONES])
+
 # Choose delivery type handler
+@timed_handler
 async def choose_delivery(update: Update, context: CallbackContext) -> int:
     query = update.callback_query
     await query.answer()
     delivery_type = query.data
     context.user_data['delivery_type'] = delivery_type
-    logger.info(f"User {query.from_user.id} chose delivery type: {delivery_type}")
+    logger.info("User %s chose delivery type: %s", query.from_user.id, delivery_type, extra={'user_id': query.from_user.id})
 
-    keyboard = [
-        [InlineKeyboardButton("Sister Mahallah", callback_data='sister')],
-        [InlineKeyboardButton("Brother Mahallah", callback_data='brother')],
-        [InlineKeyboardButton("In UIA", callback_data='in_uia')],
-        [InlineKeyboardButton("Outside UIA", callback_data='outside_uia')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = zone_keyboard()
     await query.edit_message_text(
         "Please choose the PICKUP location:",
         parse_mode="HTML",
@@ -135,12 +224,13 @@ async def choose_delivery(update: Update, context: CallbackContext) -> int:
     return CHOOSING_FROM_CATEGORY
 
 # Choose from location category handler
+@timed_handler
 async def choose_from_category(update: Update, context: CallbackContext) -> int:
     query = update.callback_query
     await query.answer()
     category = query.data
     context.user_data['from_category'] = category
-    logger.info(f"User {query.from_user.id} chose pickup category: {category}")
+    logger.info("User %s chose pickup category: %s", query.from_user.id, category, extra={'user_id': query.from_user.id})
 
     if category in ['sister', 'brother']:
         mahallahs = SISTER_MAHALLAHS if category == 'sister' else BROTHER_MAHALLAHS
@@ -156,46 +246,89 @@ async def choose_from_category(update: Update, context: CallbackContext) -> int:
         return TYPING_FROM_LOCATION
 
 # Handle specific mahallah selection for pickup
+@timed_handler
 async def handle_from_mahallah(update: Update, context: CallbackContext) -> int:
     query = update.callback_query
     await query.answer()
     mahallah = query.data.replace('from_', '')
     context.user_data['from_location'] = mahallah
-    logger.info(f"User {query.from_user.id} chose pickup mahallah: {mahallah}")
+    logger.info("User %s chose pickup mahallah: %s", query.from_user.id, mahallah, extra={'user_id': query.from_user.id})
 
-    keyboard = [
-        [InlineKeyboardButton("Sister Mahallah", callback_data='to_sister')],
-        [InlineKeyboardButton("Brother Mahallah", callback_data='to_brother')],
-        [InlineKeyboardButton("In UIA", callback_data='to_in_uia')],
-        [InlineKeyboardButton("Outside UIA", callback_data='to_outside_uia')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = zone_keyboard('to_')
     await query.edit_message_text("Please choose the DELIVERY location:", parse_mode="HTML", reply_markup=reply_markup)
     return CHOOSING_TO_CATEGORY
 
+# Buttons for the known locations closest to what the user typed, plus one to keep the
+# typed text. None when nothing is close or the text already is a known location.
+def location_suggestions(typed: str, prefix: str):
+    if location_index.lookup(typed) is not None:
+        return None
+    matches = location_index.match(typed)
+    if not matches:
+        return None
+    keyboard = [[InlineKeyboardButton(f"📍 {name}", callback_data=f"{prefix}{location_id}")] for location_id, name, _ in matches]
+    keyboard.append([InlineKeyboardButton(f"Use \"{typed}\"", callback_data=f"{prefix}new")])
+    return InlineKeyboardMarkup(keyboard)
+
+# Known location spelling for typed text, or the text itself
+def canonical_location(typed: str) -> str:
+    location_id = location_index.lookup(typed)
+    return location_index.names[location_id] if location_id is not None else typed
+
+# Location picked from location_suggestions() buttons: a known location ID or 'new' for
+# the typed text. None for anything else, or for 'new' once the typed text is gone.
+def chosen_location(choice: str, typed):
+    if choice == 'new':
+        return typed
+    try:
+        return location_index.names.get(int(choice), typed)
+    except ValueError:
+        return None
+
 # Handle custom typed pickup location
+@timed_handler
 async def handle_custom_from_location(update: Update, context: CallbackContext) -> int:
     from_location = update.message.text
-    context.user_data['from_location'] = from_location
-    logger.info(f"User {update.effective_user.id} typed pickup location: {from_location}")
+    logger.info("User %s typed pickup location: %s", update.effective_user.id, from_location, extra={'user_id': update.effective_user.id})
 
-    keyboard = [
-        [InlineKeyboardButton("Sister Mahallah", callback_data='to_sister')],
-        [InlineKeyboardButton("Brother Mahallah", callback_data='to_brother')],
-        [InlineKeyboardButton("In UIA", callback_data='to_in_uia')],
-        [InlineKeyboardButton("Outside UIA", callback_data='to_outside_uia')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    suggestions = location_suggestions(from_location, 'fromloc_')
+    if suggestions:
+        context.user_data['typed_from_location'] = from_location
+        await update.message.reply_text("Did you mean one of these PICKUP locations?", reply_markup=suggestions)
+        return CHOOSING_FROM_MATCH
+    context.user_data.pop('typed_from_location', None)
+    context.user_data['from_location'] = canonical_location(from_location)
+
+    reply_markup = zone_keyboard('to_')
     await update.message.reply_text("Please choose the DELIVERY location:", parse_mode="HTML", reply_markup=reply_markup)
     return CHOOSING_TO_CATEGORY
 
+# Handle the choice between suggested pickup locations and the typed one
+@timed_handler
+async def handle_from_match(update: Update, context: CallbackContext) -> int:
+    query = update.callback_query
+    await query.answer()
+    choice = query.data.replace('fromloc_', '')
+    from_location = chosen_location(choice, context.user_data.pop('typed_from_location', None))
+    if from_location is None:
+        logger.warning("User %s sent an unknown pickup choice: %s", query.from_user.id, choice, extra={'user_id': query.from_user.id})
+        await query.edit_message_text("Please type the PICKUP location again:")
+        return TYPING_FROM_LOCATION
+    context.user_data['from_location'] = from_location
+    logger.info("User %s chose pickup location: %s", query.from_user.id, from_location, extra={'user_id': query.from_user.id})
+
+    reply_markup = zone_keyboard('to_')
+    await query.edit_message_text("Please choose the DELIVERY location:", parse_mode="HTML", reply_markup=reply_markup)
+    return CHOOSING_TO_CATEGORY
+
 # Choose to location category handler
+@timed_handler
 async def choose_to_category(update: Update, context: CallbackContext) -> int:
     query = update.callback_query
     await query.answer()
     category = query.data.replace('to_', '')
     context.user_data['to_category'] = category
-    logger.info(f"User {query.from_user.id} chose delivery category: {category}")
+    logger.info("User %s chose delivery category: %s", query.from_user.id, category, extra={'user_id': query.from_user.id})
 
     if category in ['sister', 'brother']:
         mahallahs = SISTER_MAHALLAHS if category == 'sister' else BROTHER_MAHALLAHS
@@ -215,23 +348,48 @@ async def choose_to_category(update: Update, context: CallbackContext) -> int:
         return TYPING_TO_LOCATION
 
 # Handle specific mahallah selection for delivery
+@timed_handler
 async def handle_to_mahallah(update: Update, context: CallbackContext) -> int:
     query = update.callback_query
     await query.answer()
     mahallah = query.data.replace('to_', '')
     context.user_data['to_location'] = mahallah
-    logger.info(f"User {query.from_user.id} chose delivery mahallah: {mahallah}")
+    logger.info("User %s chose delivery mahallah: %s", query.from_user.id, mahallah, extra={'user_id': query.from_user.id})
     await display_order_summary(query, context)
     return CONFIRMING_ORDER
 
 # Handle custom typed delivery location
+@timed_handler
 async def handle_custom_to_location(update: Update, context: CallbackContext) -> int:
     to_location = update.message.text
-    context.user_data['to_location'] = to_location
-    logger.info(f"User {update.effective_user.id} typed delivery location: {to_location}")
+    logger.info("User %s typed delivery location: %s", update.effective_user.id, to_location, extra={'user_id': update.effective_user.id})
+
+    suggestions = location_suggestions(to_location, 'toloc_')
+    if suggestions:
+        context.user_data['typed_to_location'] = to_location
+        await update.message.reply_text("Did you mean one of these DELIVERY locations?", reply_markup=suggestions)
+        return CHOOSING_TO_MATCH
+    context.user_data.pop('typed_to_location', None)
+    context.user_data['to_location'] = canonical_location(to_location)
     await display_order_summary(update, context)
     return CONFIRMING_ORDER
 
+# Handle the choice between suggested delivery locations and the typed one
+@timed_handler
+async def handle_to_match(update: Update, context: CallbackContext) -> int:
+    query = update.callback_query
+    await query.answer()
+    choice = query.data.replace('toloc_', '')
+    to_location = chosen_location(choice, context.user_data.pop('typed_to_location', None))
+    if to_location is None:
+        logger.warning("User %s sent an unknown delivery choice: %s", query.from_user.id, choice, extra={'user_id': query.from_user.id})
+        await query.edit_message_text("Please type the DELIVERY location again:")
+        return TYPING_TO_LOCATION
+    context.user_data['to_location'] = to_location
+    logger.info("User %s chose delivery location: %s", query.from_user.id, to_location, extra={'user_id': query.from_user.id})
+    await display_order_summary(query, context)
+    return CONFIRMING_ORDER
+
 # Display order summary and confirmation buttons
 async def display_order_summary(update: Update, context: CallbackContext) -> None:
     summary = (
@@ -253,7 +411,8 @@ async def display_order_summary(update: Update, context: CallbackContext) -> Non
     else:  # CallbackQuery
         await update.edit_message_text(summary, reply_markup=reply_markup)
 
-# Handle order confirmation and post to runner group
+# Handle order confirmation and post to the pickup zone's runner channel and subscribers
+@timed_handler
 async def handle_confirmation(update: Update, context: CallbackContext) -> int:
     query = update.callback_query
     await query.answer()
@@ -261,15 +420,14 @@ async def handle_confirmation(update: Update, context: CallbackContext) -> int:
         user_id = update.effective_user.id
         username = update.effective_user.username
 
+        # Checked again here, the customer may have confirmed other orders since /start
+        if await repo.count_pending_orders(user_id) >= MAX_PENDING_ORDERS:
+            logger.info("User %s has too many pending orders.", user_id, extra={'user_id': user_id})
+            await query.edit_message_text(TOO_MANY_PENDING)
+            return ConversationHandler.END
+
         # Check if customer is already in the database
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM Customers WHERE user_id=?", (user_id,))
-        customer = cursor.fetchone()
-        if not customer:
-            cursor.execute("INSERT INTO Customers (user_id, username) VALUES (?, ?)", (user_id, username))
-            logger.debug(f"New customer inserted: user_id={user_id}, username={username}")
-        conn.commit()
+        await repo.ensure_customer(user_id, username)
 
         order_data = {
             "customer_id": user_id,
@@ -279,17 +437,19 @@ async def handle_confirmation(update: Update, context: CallbackContext) -> int:
         }
 
         # Generate order ID with timestamp and counter
-        counter = get_next_counter()
-        order_id = f"ORDER_{datetime.now().strftime('%y%m%d_%H%M%S')}_{counter}"
-        logger.info(f"Order ID generated: {order_id} for user {user_id}")
-
-        # Insert order into database
-        cursor.execute('''
-            INSERT INTO Orders (id, customer_id, delivery_type, from_location, to_location)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (order_id, order_data['customer_id'], order_data['delivery_type'], order_data['from_location'], order_data['to_location']))
-        conn.commit()
-        logger.debug(f"New order inserted: order_id={order_id}, customer_id={order_data['customer_id']}")
+        order_time = now_ms()
+        counter = await repo.next_order_number()
+        order_id = f"ORDER_{datetime.fromtimestamp(order_time / 1000).strftime('%y%m%d_%H%M%S')}_{counter}"
+        logger.info("Order ID generated: %s for user %s", order_id, user_id, extra={'order_id': order_id, 'user_id': user_id})
+
+        # Insert order into database, new locations join the index for later suggestions
+        location_ids = await repo.create_order(order_id, order_data['customer_id'], order_data['delivery_type'], order_data['from_location'], order_data['to_location'], order_time)
+        for location_id, name in zip(location_ids, (order_data['from_location'], order_data['to_location'])):
+            if location_id is not None:
+                location_index.add(location_id, name)
+                location_index.record_use(location_id)
+        page_cache.invalidate('c', user_id)
+        logger.debug("New order inserted: order_id=%s, customer_id=%s", order_id, order_data['customer_id'], extra={'order_id': order_id, 'user_id': user_id})
 
         # Create message for runner group
         runner_message = (
@@ -297,22 +457,16 @@ async def handle_confirmation(update: Update, context: CallbackContext) -> int:
             f"Type  : {order_data['delivery_type'].capitalize()}\n"
             f"From : {order_data['from_location']}\n"
             f"To      : {order_data['to_location']}\n"
-            f"Time : {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+            f"Time : {format_ms(order_time)}"
         )
 
         # Create accept button for runners
         keyboard = [[InlineKeyboardButton("Accept Order", callback_data=f"accept_{order_id}")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
 
+        zone = context.user_data.get('from_category')
+        runner_chat_id = router.chat_for(zone)
         try:
-            # Send to runner group and get the message object
-            runner_message_obj = await context.bot.send_message(
-                chat_id=RUNNER_GROUP_ID,
-                text=runner_message,
-                reply_markup=reply_markup
-            )
-            logger.info(f"Order ID: {order_id} sent to runner group.")
-
             # Notify customer and keep order details visible
             message = await query.edit_message_text(
                 f"✅ Your order has been posted to runners! "
@@ -322,173 +476,489 @@ async def handle_confirmation(update: Update, context: CallbackContext) -> int:
                 f"Delivery Type: {order_data['delivery_type'].capitalize()}\n"
                 f"From: {order_data['from_location']}\n"
                 f"To: {order_data['to_location']}\n"
-                f"Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+                f"Time: {format_ms(order_time)}\n\n"
                 "If you want to cancel the order, click the button below.",
                 reply_markup=InlineKeyboardMarkup([
                     [InlineKeyboardButton("❌ Cancel Order", callback_data=f"cancel_{order_id}")]
                 ])
             )
+            await repo.set_message_ids(order_id, message.message_id, runner_chat_id, None)
 
-            # Update order with message IDs
-            cursor.execute('''
-                UPDATE Orders
-                SET customer_message_id = ?, runner_message_id = ?
-                WHERE id = ?
-            ''', (message.message_id, runner_message_obj.message_id, order_id))
-            conn.commit()
+            # The runner posts wait for their chats' rate, don't hold up the handler
+            context.application.create_task(post_order(
+                context, order_id, zone, runner_chat_id, runner_message, reply_markup, message
+            ))
         except Exception as e:
-            logger.error(f"Error sending order ID: {order_id} to runner group: {e}")
+            logger.error("Error confirming order ID: %s: %s", order_id, e, extra={'order_id': order_id})
             await query.edit_message_text(
                 "There was an error posting your order to runners. "
                 "Please try again or contact support."
             )
-        finally:
-            conn.close()
-        logger.info(f"User {query.from_user.id} confirmed order. Order ID: {order_id}")
+        logger.info("User %s confirmed order. Order ID: %s", query.from_user.id, order_id, extra={'order_id': order_id, 'user_id': query.from_user.id})
     else:
         await query.edit_message_text("Order cancelled. Type /start to create a new order.")
-        logger.info(f"User {query.from_user.id} cancelled order before confirmation.")
+        logger.info("User %s cancelled order before confirmation.", query.from_user.id, extra={'user_id': query.from_user.id})
     return ConversationHandler.END
 
+# Background task of handle_confirmation: post the order to the zone's runner channel
+# through the throttled queue and DM the zone's subscribers, then record the message IDs. An
+# order whose channel post failed is cancelled. An order cancelled, expired or accepted
+# from a copy while the posts were queued has the new posts closed again.
+async def post_order(context, order_id, zone, runner_chat_id, text, reply_markup, customer_message):
+    post = f"post to runner chat {runner_chat_id}"
+    sent = await dispatch({
+        post: outbox.send(runner_chat_id, partial(
+            context.bot.send_message,
+            chat_id=runner_chat_id,
+            text=text,
+            reply_markup=reply_markup
+        ), PRIORITY_NEW_ORDER),
+        **{
+            f"send copy to runner {runner_id}": send_to(runner_id, partial(
+                context.bot.send_message,
+                chat_id=runner_id,
+                text=text,
+                reply_markup=reply_markup
+            ), PRIORITY_NEW_ORDER)
+            for runner_id in router.subscribers_for(zone)
+        },
+    }, order_id=order_id)
+    posted = sent.pop(post)
+    copies = [(result.chat_id, result.message_id) for result in sent.values() if not isinstance(result, Exception)]
+    runner_message_id = None if isinstance(posted, Exception) else posted.message_id
+    await repo.set_message_ids(order_id, customer_message.message_id, runner_chat_id, runner_message_id, copies)
+
+    if isinstance(posted, Exception):
+        logger.error("Error sending order ID: %s to runner chat %s: %s", order_id, runner_chat_id, posted, extra={'order_id': order_id})
+        # The copies went out at the same time and may have reached runners. Cancel the order
+        # so it is neither acceptable from them nor counted as pending; a runner who already
+        # accepted it from a copy keeps it, and the customer has been told as usual.
+        cancelled = await repo.cancel_order(order_id, now_ms())
+        if cancelled:
+            page_cache.invalidate('c', cancelled['customer_id'])
+            await dispatch({'tell customer the post failed': customer_message.edit_text(
+                "There was an error posting your order to runners, it has been cancelled. "
+                "Please try again or contact support."
+            )}, order_id=order_id)
+    else:
+        logger.info("Order ID: %s sent to runner chat %s (zone %s).", order_id, runner_chat_id, zone, extra={'order_id': order_id})
+
+    order = await repo.get_order(order_id)
+    if order['status'] != 'pending':
+        await dispatch(edit_runner_messages(
+            context, order, copies, f"Order #{order_id} is no longer available ({order['status']}).",
+            PRIORITY_STATUS, action="close late post"
+        ), order_id=order_id)
+
 # Handle order cancellation by the user
+@timed_handler
 async def handle_cancellation(update: Update, context: CallbackContext) -> None:
     query = update.callback_query
     await query.answer()
     order_id = query.data.replace('cancel_', '')
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT Orders.*, Customers.username
-        FROM Orders
-        JOIN Customers ON Orders.customer_id = Customers.user_id
-        WHERE Orders.id=?
-    ''', (order_id,))
-    order = cursor.fetchone()
-
-    if order and order['status'] == 'pending':
-        cursor.execute('''
-            UPDATE Orders
-            SET status = 'cancelled', cancelled_at = ?
-            WHERE id = ?
-        ''', (datetime.now().isoformat(), order_id))
-        conn.commit()
-        logger.debug(f"Order ID: {order_id} status updated to cancelled.")
-
-        await query.edit_message_text("Your order has been cancelled.")
-        logger.info(f"User {query.from_user.id} cancelled order ID: {order_id}")
-
-        # Edit the original runner group message to indicate cancellation and remove the accept button
-        await context.bot.edit_message_text(
-            chat_id=RUNNER_GROUP_ID,
-            message_id=order['runner_message_id'],
-            text=(
+    # Only the first update to reach a pending order changes it
+    order = await repo.cancel_order(order_id, now_ms())
+
+    if order:
+        page_cache.invalidate('c', order['customer_id'])
+        logger.debug("Order ID: %s status updated to cancelled.", order_id, extra={'order_id': order_id})
+        logger.info("User %s cancelled order ID: %s", query.from_user.id, order_id, extra={'order_id': order_id, 'user_id': query.from_user.id})
+
+        # Tell the customer and edit every runner message of the order to remove the accept
+        # button, in the background as the runner edits wait for their chats' rate
+        copies = (await repo.get_order_copies([order_id]))[order_id]
+        context.application.create_task(dispatch({
+            'confirm cancellation to customer': query.edit_message_text("Your order has been cancelled."),
+            **edit_runner_messages(context, order, copies, (
                 f"Order #{order_id} has been cancelled by the user.\n\n"
                 f"Type  : {order['delivery_type'].capitalize()}\n"
                 f"From : {order['from_location']}\n"
                 f"To      : {order['to_location']}\n"
-                f"Time : {order['order_time']}\n"
-            ),
-            reply_markup=None
-        )
+                f"Time : {format_ms(order['order_time'])}\n"
+            ), PRIORITY_STATUS),
+        }, order_id=order_id))
     else:
         await query.edit_message_text("This order cannot be cancelled.")
-        logger.warning(f"User {query.from_user.id} tried to cancel order ID: {order_id}, but it was not pending or not found.")
-    conn.close()
+        logger.warning("User %s tried to cancel order ID: %s, but it was not pending or not found.", query.from_user.id, order_id, extra={'order_id': order_id, 'user_id': query.from_user.id})
 
 # Handle when a runner accepts an order
+@timed_handler
 async def handle_runner_acceptance(update: Update, context: CallbackContext) -> None:
     query = update.callback_query
-    await query.answer()
     order_id = query.data.replace('accept_', '')
     runner = update.effective_user
-    logger.info(f"Runner {runner.id} (@{runner.username}) attempting to accept order ID: {order_id}")
-
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT Orders.*, Customers.username
-        FROM Orders
-        JOIN Customers ON Orders.customer_id = Customers.user_id
-        WHERE Orders.id=?
-    ''', (order_id,))
-    order = cursor.fetchone()
-
-    if order and order['status'] == 'pending':
-        # Update order status and runner details
-        cursor.execute('''
-            UPDATE Orders
-            SET status = 'accepted', runner_id = ?, accept_time = ?
-            WHERE id = ?
-        ''', (runner.id, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), order_id))
-        conn.commit()
-        logger.debug(f"Order ID: {order_id} status updated to accepted, runner_id={runner.id}")
-
-        # Check if runner is already in the database
-        cursor.execute("SELECT * FROM Runners WHERE user_id=?", (runner.id,))
-        runner_record = cursor.fetchone()
-        if not runner_record:
-            cursor.execute("INSERT INTO Runners (user_id, username) VALUES (?, ?)", (runner.id, runner.username))
-            conn.commit()
-        logger.debug(f"New runner inserted: user_id={runner.id}, username={runner.username}")
-
-        # Update runner group message
+    logger.info("Runner %s (@%s) attempting to accept order ID: %s", runner.id, runner.username, order_id, extra={'order_id': order_id, 'user_id': runner.id})
+
+    # Update order status and runner details, only one racing runner gets the order back
+    order = await repo.accept_order(order_id, runner.id, runner.username, now_ms())
+
+    if order:
+        await query.answer()
+        page_cache.invalidate('c', order['customer_id'])
+        page_cache.invalidate('r', runner.id)
+        logger.debug("Order ID: %s status updated to accepted, runner_id=%s", order_id, runner.id, extra={'order_id': order_id, 'user_id': runner.id})
+
         runner_message = (
             f"#{order_id}\n\n"
             f"Type  : {order['delivery_type'].capitalize()}\n"
             f"From : {order['from_location']}\n"
             f"To      : {order['to_location']}\n"
-            f"Time : {order['order_time']}\n\n"
+            f"Time : {format_ms(order['order_time'])}\n\n"
             f"✅ Accepted by @{runner.username}"
         )
-        await query.edit_message_text(runner_message, reply_markup=None)
-
-        # Notify customer with a new message
-        await context.bot.send_message(
-            chat_id=order['customer_id'],
-            text=f"✅ Accepted by @{runner.username}\n\n"
-                 f"📋 Order Summary:\n"
-                 f"Order ID: #{order_id}\n"
-                 f"Delivery Type: {order['delivery_type'].capitalize()}\n"
-                 f"From: {order['from_location']}\n"
-                 f"To: {order['to_location']}\n"
-                 f"Time: {order['order_time']}\n\n"
-                 "The order is now being processed."
+        customer_message = (
+            f"✅ Accepted by @{runner.username}\n\n"
+            f"📋 Order Summary:\n"
+            f"Order ID: #{order_id}\n"
+            f"Delivery Type: {order['delivery_type'].capitalize()}\n"
+            f"From: {order['from_location']}\n"
+            f"To: {order['to_location']}\n"
+            f"Time: {format_ms(order['order_time'])}\n\n"
+            "The order is now being processed."
         )
-
-        # Delete the previous message from the customer's chat
-        await context.bot.delete_message(
-            chat_id=order['customer_id'],
-            message_id=order['customer_message_id']
-        )
-
-        # Direct message the runner with customer's username or Telegram link
         customer_username = order['username']
-        await context.bot.send_message(
-            chat_id=runner.id,
-            text=f"You have accepted the order #{order_id}.\n"
-                 f"Customer's username: @{customer_username}\n"
-                 f"Please contact the customer for further details."
+        runner_dm = (
+            f"You have accepted the order #{order_id}.\n"
+            f"Customer's username: @{customer_username}\n"
+            f"Please contact the customer for further details."
         )
-        logger.info(f"Runner {runner.id} (@{runner.username}) successfully accepted order ID: {order_id}")
+
+        # Update the runner messages (channel post and subscriber copies), notify the customer
+        # with a new message, delete their previous one and DM the runner, all at once and in
+        # the background so throttled runner edits don't hold up the handler
+        copies = (await repo.get_order_copies([order_id]))[order_id]
+        context.application.create_task(dispatch({
+            **edit_runner_messages(context, order, copies, runner_message, PRIORITY_STATUS),
+            'notify customer': context.bot.send_message(chat_id=order['customer_id'], text=customer_message),
+            'delete previous customer message': context.bot.delete_message(
+                chat_id=order['customer_id'],
+                message_id=order['customer_message_id']
+            ),
+            'DM runner': context.bot.send_message(chat_id=runner.id, text=runner_dm),
+        }, order_id=order_id))
+        logger.info("Runner %s (@%s) successfully accepted order ID: %s", runner.id, runner.username, order_id, extra={'order_id': order_id, 'user_id': runner.id})
     else:
-        await query.edit_message_text(
-            f"{query.message.text}\n\n"
-            "❌ This order is no longer available.",
-            reply_markup=None
-        )
-        logger.warning(f"Runner {runner.id} (@{runner.username}) tried to accept order ID: {order_id}, but it was not pending or not found.")
-    conn.close()
+        # Only the losing runner sees this. The winner's edit of the shared message is
+        # already queued, editing it here too could overwrite it with stale text.
+        await query.answer(f"Order #{order_id} is no longer available.", show_alert=True)
+        logger.warning("Runner %s (@%s) tried to accept order ID: %s, but it was not pending or not found.", runner.id, runner.username, order_id, extra={'order_id': order_id, 'user_id': runner.id})
+
+# Periodic job: expire pending orders nobody accepted within PENDING_ORDER_TTL seconds,
+# then clear their Accept buttons and tell the customers
+async def expire_stale_orders(context: CallbackContext) -> None:
+    orders = await repo.expire_pending_orders(now_ms() - PENDING_ORDER_TTL * 1000, EXPIRY_BATCH_SIZE)
+    if not orders:
+        return
+    logger.info("Expired %s pending orders older than %ss", len(orders), PENDING_ORDER_TTL)
+
+    calls = {}
+    copies = await repo.get_order_copies([order['id'] for order in orders])
+    for order in orders:
+        order_id = order['id']
+        page_cache.invalidate('c', order['customer_id'])
+        calls.update(edit_runner_messages(context, order, copies[order_id], (
+            f"Order #{order_id} expired without a runner.\n\n"
+            f"Type  : {order['delivery_type'].capitalize()}\n"
+            f"From : {order['from_location']}\n"
+            f"To      : {order['to_location']}\n"
+            f"Time : {format_ms(order['order_time'])}\n"
+        ), PRIORITY_COSMETIC, action=f"expire order {order_id}"))
+        if order['customer_message_id']:
+            calls[f"notify customer of expiry {order_id}"] = context.bot.edit_message_text(
+                chat_id=order['customer_id'],
+                message_id=order['customer_message_id'],
+                text=(
+                    f"⌛ Your order #{order_id} expired because no runner accepted it.\n"
+                    "Type /start to place it again."
+                ),
+                reply_markup=None
+            )
+
+    # Throttled sends can take a while, so don't hold up the job queue
+    context.application.create_task(dispatch(calls))
+
+# Periodic job: drop the in-memory user_data of users idle for CONVERSATION_TTL, their
+# conversations have timed out by then. Without it application.user_data keeps an entry
+# for every user since startup.
+async def drop_idle_user_data(context: CallbackContext) -> None:
+    idle = context.application.persistence.idle_users()
+    for user_id in idle:
+        context.application.drop_user_data(user_id)
+    if idle:
+        logger.info("Dropped user_data of %s users idle for %ss", len(idle), CONVERSATION_TTL)
+
+# Periodic job: move finished orders older than ARCHIVE_AFTER_DAYS to the archive
+# database and give the freed pages back. Every batch is its own repository job, so
+# handlers' queries run in between.
+async def archive_old_orders(context: CallbackContext) -> None:
+    cutoff = now_ms() - ARCHIVE_AFTER_DAYS * 24 * 60 * 60 * 1000
+    archived = 0
+    while moved := await repo.run(archive_batch, cutoff):
+        archived += moved
+    if not archived:
+        return
+    freed = 0
+    while pages := await repo.run(vacuum_step):
+        freed += pages
+    logger.info("Archived %s orders older than %s days, freed %s pages", archived, ARCHIVE_AFTER_DAYS, freed)
 
 # Cancel command handler
+@timed_handler
 async def cancel(update: Update, context: CallbackContext) -> int:
     await update.message.reply_text("Order cancelled. Type /start to create a new order.")
-    logger.info(f"User {update.effective_user.id} cancelled order using /cancel command.")
+    logger.info("User %s cancelled order using /cancel command.", update.effective_user.id, extra={'user_id': update.effective_user.id})
     return ConversationHandler.END
 
-# Main function to set up and run the bot
-def main() -> None:
-    application = Application.builder().token(BOT_TOKEN).build()
+# A page of a user's order history, from the cache when it was shown recently.
+# Returns (rows, has_prev, has_next), newest first.
+async def order_page(role, user_id, cursor=None, older=True):
+    key = (role, user_id, cursor, older)
+    page = page_cache.get(key)
+    if page is None:
+        rows, more = await repo.get_order_page(ROLES[role], user_id, cursor, older, PAGE_SIZE)
+        if older:
+            page = (rows, cursor is not None, more)
+        else:
+            page = (rows, more, True)
+        page_cache.put(key, page)
+    return page
+
+# Text and Prev/Next buttons for a history page
+def history_message(role, rows, has_prev, has_next):
+    if not rows:
+        if role == 'c':
+            return "You have no orders yet. Type /start to place one.", None
+        return "You have not accepted any orders yet.", None
+
+    title = "📋 Your orders" if role == 'c' else "🏃 Your runs"
+    entries = [
+        f"#{row['id']} {STATUS_LABELS.get(row['status'], row['status'])}\n"
+        f"{row['delivery_type'].capitalize()}: {row['from_location']} → {row['to_location']}\n"
+        f"{format_ms(row['order_time'])}"
+        for row in rows
+    ]
+    buttons = []
+    if has_prev:
+        buttons.append(InlineKeyboardButton("⬅️ Newer", callback_data=page_button_data(role, False, rows[0]['order_time'], rows[0]['id'])))
+    if has_next:
+        buttons.append(InlineKeyboardButton("Older ➡️", callback_data=page_button_data(role, True, rows[-1]['order_time'], rows[-1]['id'])))
+    return f"{title}, newest first:\n\n" + "\n\n".join(entries), InlineKeyboardMarkup([buttons]) if buttons else None
+
+# /myorders: the orders the user placed, PAGE_SIZE at a time
+@timed_handler
+async def my_orders(update: Update, context: CallbackContext) -> None:
+    text, reply_markup = history_message('c', *await order_page('c', update.effective_user.id))
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+# /runs: the orders the user accepted as a runner
+@timed_handler
+async def runs(update: Update, context: CallbackContext) -> None:
+    text, reply_markup = history_message('r', *await order_page('r', update.effective_user.id))
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+# Prev/Next on a /myorders or /runs page. The page is always the clicking user's own.
+@timed_handler
+async def handle_history_page(update: Update, context: CallbackContext) -> None:
+    query = update.callback_query
+    page = parse_page_button(query.data)
+    if page is None:
+        logger.warning("User %s sent a bad history page button: %s", query.from_user.id, query.data, extra={'user_id': query.from_user.id})
+        await query.answer("This button is no longer valid, send /myorders or /runs again.", show_alert=True)
+        return
+    await query.answer()
+    role, older, cursor = page
+    rows, has_prev, has_next = await order_page(role, query.from_user.id, cursor, older)
+    if not rows:
+        await query.edit_message_text("No more orders.", reply_markup=None)
+        return
+    text, reply_markup = history_message(role, rows, has_prev, has_next)
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+# Runners are the members of the runner chat a zone's orders are posted to. Anyone else
+# could otherwise /subscribe and get every order's pickup and drop-off in their DMs.
+async def is_zone_runner(context: CallbackContext, user_id: int, zone: str) -> bool:
+    chat_id = router.chat_for(zone)
+    try:
+        member = await context.bot.get_chat_member(chat_id, user_id)
+    except TelegramError as e:
+        logger.warning("Could not check user %s in runner chat %s: %s", user_id, chat_id, e, extra={'user_id': user_id})
+        return False
+    return member.status in RUNNER_STATUSES
+
+# /subscribe <zone>: DM new orders picked up in that zone to the runner
+@timed_handler
+async def subscribe(update: Update, context: CallbackContext) -> None:
+    runner_id = update.effective_user.id
+    if len(context.args) != 1 or context.args[0] not in ZONES:
+        current = ', '.join(ZONE_NAMES[zone] for zone in router.zones_of(runner_id)) or "none"
+        await update.message.reply_text(
+            f"Usage: /subscribe <zone>, where zone is one of: {', '.join(ZONES)}\n"
+            f"Your zones: {current}"
+        )
+        return
+    zone = context.args[0]
+    if not await is_zone_runner(context, runner_id, zone):
+        logger.warning("User %s tried to subscribe to zone %s without being a runner there", runner_id, zone, extra={'user_id': runner_id})
+        await update.message.reply_text(f"Only runners in the {ZONE_NAMES[zone]} runner chat can subscribe to its orders.")
+        return
+    await repo.subscribe(runner_id, zone)
+    router.subscribe(runner_id, zone)
+    logger.info("Runner %s subscribed to zone %s", runner_id, zone, extra={'user_id': runner_id})
+    await update.message.reply_text(f"You will get new {ZONE_NAMES[zone]} orders here. /unsubscribe {zone} to stop.")
+
+# /unsubscribe <zone>: stop the DMs for that zone
+@timed_handler
+async def unsubscribe(update: Update, context: CallbackContext) -> None:
+    runner_id = update.effective_user.id
+    if len(context.args) != 1 or context.args[0] not in ZONES:
+        await update.message.reply_text(f"Usage: /unsubscribe <zone>, where zone is one of: {', '.join(ZONES)}")
+        return
+    zone = context.args[0]
+    await repo.unsubscribe(runner_id, zone)
+    router.unsubscribe(runner_id, zone)
+    logger.info("Runner %s unsubscribed from zone %s", runner_id, zone, extra={'user_id': runner_id})
+    await update.message.reply_text(f"You will no longer get {ZONE_NAMES[zone]} orders.")
+
+# /block <user_id> and /unblock <user_id>, admins only: stop or allow a customer's /start
+@timed_handler
+async def set_blocked(update: Update, context: CallbackContext) -> None:
+    admin_id = update.effective_user.id
+    command = update.message.text.split()[0].lstrip('/').split('@')[0]
+    if admin_id not in ADMIN_IDS:
+        logger.warning("User %s tried to /%s without being an admin", admin_id, command, extra={'user_id': admin_id})
+        await update.message.reply_text("Only admins can do that.")
+        return
+    if len(context.args) != 1 or not context.args[0].lstrip('-').isdigit():
+        await update.message.reply_text(f"Usage: /{command} <user_id>")
+        return
+    user_id = int(context.args[0])
+    blocked = command == 'block'
+    await authorizer.set_blocked(user_id, blocked)
+    logger.info("Admin %s %s user %s", admin_id, 'blocked' if blocked else 'unblocked', user_id, extra={'user_id': user_id})
+    await update.message.reply_text(f"User {user_id} is now {'blocked' if blocked else 'unblocked'}.")
+
+# Periodic job with several workers: pick up /subscribe changes made through other workers
+async def refresh_subscriptions(context: CallbackContext) -> None:
+    router.load(await repo.get_subscriptions())
+
+# Periodic job with several workers: pick up locations first used through other workers.
+# Reads on from the last ID loaded from the table, not the highest ID known: this worker's
+# own inserts may be ahead of another worker's earlier ones.
+async def refresh_locations(context: CallbackContext) -> None:
+    rows = await repo.get_locations(location_index.last_loaded_id)
+    if rows:
+        location_index.load(rows)
+
+# Refresh the gauges read from the database and queues before each metrics scrape
+async def refresh_gauges() -> None:
+    # Statuses with no orders left report 0 rather than their last count
+    counts = dict.fromkeys(STATUS_LABELS, 0)
+    counts.update(await repo.count_orders_by_status())
+    for status, count in counts.items():
+        ORDERS.set(count, status=status)
+    for event, count in authorizer.stats.items():
+        AUTH_CACHE.set(count, event=event)
+    for stat, value in repo.stats().items():
+        DATABASE.set(value, stat=stat)
+    for stat, value in persistence.stats.items():
+        PERSISTENCE.set(value, stat=stat)
+    for event, count in page_cache.stats.items():
+        PAGE_CACHE.set(count, event=event)
+    outbound = outbox.stats()
+    for chat_id, depth in outbound.pop('depth').items():
+        OUTBOUND_DEPTH.set(depth, chat_id=chat_id)
+    OUTBOUND_WAIT.set(outbound.pop('wait_avg'), stat='avg')
+    OUTBOUND_WAIT.set(outbound.pop('wait_max'), stat='max')
+    for result, count in outbound.items():
+        OUTBOUND_CALLS.set(count, result=result)
+
+# Load runner subscriptions and start the metrics endpoint once the application is
+# initialized, then log how long startup took
+async def post_init(application: Application) -> None:
+    startup.end('initialize')
+    with startup.phase('subscriptions'):
+        router.load(await repo.get_subscriptions())
+    with startup.phase('locations'):
+        location_index.load(await repo.get_locations())
+    # The index is long-lived, keep the garbage collector from walking it on every full pass
+    with startup.phase('gc'):
+        gc.collect()
+        gc.freeze()
+    with startup.phase('metrics'):
+        # Metrics are not worth refusing orders over, run without them if the port is taken
+        port = METRICS_PORT + application.bot_data.get('worker_index', 0)
+        try:
+            application.bot_data['metrics_server'] = await start_metrics_server(refresh_gauges, port=port)
+        except OSError as e:
+            logger.warning("Not serving metrics, could not listen on port %s: %s", port, e)
+    for phase, seconds in startup.phases.items():
+        STARTUP_SECONDS.set(seconds, phase=phase)
+    logger.info(startup.summary())
+
+# Stop the outbound queue, database thread and log listener once the application shuts down
+async def shutdown(application: Application) -> None:
+    metrics_server = application.bot_data.pop('metrics_server', None)
+    if metrics_server is not None:
+        metrics_server.close()
+    logger.info("Outbound queue stats: %s", outbox.stats())
+    logger.info("Rate limiter stats: %s", limiter.stats)
+    logger.info("Authorization stats: %s", authorizer.stats)
+    await outbox.close()
+    repo.close()
+    stop_logging()
+
+# Application that handles up to CONCURRENT_UPDATES updates at once, so one user's slow
+# handler (a throttled post, a Bot API call) no longer holds up everyone else. Each user's
+# updates still run one at a time and in order, as ConversationHandler relies on.
+class PerUserApplication(Application):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._user_locks = {}   # user or chat ID -> [lock, updates holding or waiting for it]
+
+    async def process_update(self, update: object) -> None:
+        key = None
+        if isinstance(update, Update):
+            sender = update.effective_user or update.effective_chat
+            key = sender.id if sender is not None else None
+        if key is None:
+            await super().process_update(update)
+            return
+        entry = self._user_locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await super().process_update(update)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._user_locks[key]
+
+    # Close the outbox before PTB waits for the create_task() sends: they would otherwise
+    # hold up stopping for as long as the throttled backlog takes to drain
+    async def stop(self) -> None:
+        await outbox.close()
+        await super().stop()
+
+# Build the application with all handlers and jobs. workers.py builds one per worker
+# process, without an updater, and feeds it that worker's share of the updates.
+def build_application(worker_index: int = 0, updater: bool = True) -> Application:
+    builder = (
+        Application.builder()
+        .application_class(PerUserApplication)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .token(BOT_TOKEN)
+        .base_url(f"{BOT_API_URL}/bot")
+        .base_file_url(f"{BOT_API_URL}/file/bot")
+        .request(instrumented_request(connection_pool_size=256))
+        .persistence(persistence)
+        .post_init(post_init)
+        .post_shutdown(shutdown)
+    )
+    if not updater:
+        builder.updater(None)
+    application = builder.build()
+    application.bot_data['worker_index'] = worker_index
 
     # Set up conversation handler
     conv_handler = ConversationHandler(
@@ -506,6 +976,11 @@ def main() -> None:
             TYPING_FROM_LOCATION: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, handle_custom_from_location)
             ],
+            # Typing again instead of picking a suggestion looks the new text up
+            CHOOSING_FROM_MATCH: [
+                CallbackQueryHandler(handle_from_match, pattern='^fromloc_'),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_custom_from_location)
+            ],
             CHOOSING_TO_CATEGORY: [
                 CallbackQueryHandler(choose_to_category, pattern='^to_')
             ],
@@ -515,20 +990,80 @@ def main() -> None:
             TYPING_TO_LOCATION: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, handle_custom_to_location)
             ],
+            CHOOSING_TO_MATCH: [
+                CallbackQueryHandler(handle_to_match, pattern='^toloc_'),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_custom_to_location)
+            ],
             CONFIRMING_ORDER: [
                 CallbackQueryHandler(handle_confirmation, pattern='^(confirm|cancel)$')
             ]
         },
-        fallbacks=[CommandHandler('start', start), CommandHandler('cancel', cancel)]
+        fallbacks=[CommandHandler('start', start), CommandHandler('cancel', cancel)],
+        conversation_timeout=CONVERSATION_TTL,
+        name='order_conversation',
+        persistent=True
     )
 
+    application.add_handler(TypeHandler(Update, throttle), group=-1)
     application.add_handler(conv_handler)
     application.add_handler(CallbackQueryHandler(handle_runner_acceptance, pattern='^accept_'))
     application.add_handler(CallbackQueryHandler(handle_cancellation, pattern='^cancel_'))
+    application.add_handler(CommandHandler('myorders', my_orders, filters=filters.ChatType.PRIVATE))
+    application.add_handler(CommandHandler('runs', runs, filters=filters.ChatType.PRIVATE))
+    application.add_handler(CallbackQueryHandler(handle_history_page, pattern='^page_'))
+    application.add_handler(CommandHandler('subscribe', subscribe, filters=filters.ChatType.PRIVATE))
+    application.add_handler(CommandHandler('unsubscribe', unsubscribe, filters=filters.ChatType.PRIVATE))
+    application.add_handler(CommandHandler(['block', 'unblock'], set_blocked, filters=filters.ChatType.PRIVATE))
+    application.job_queue.run_repeating(drop_idle_user_data, interval=IDLE_USER_SWEEP_INTERVAL, first=IDLE_USER_SWEEP_INTERVAL)
+    # Expiry and archiving are safe to run anywhere, but one sweeper is enough
+    if worker_index == 0:
+        application.job_queue.run_repeating(expire_stale_orders, interval=EXPIRY_SWEEP_INTERVAL, first=EXPIRY_SWEEP_INTERVAL)
+        application.job_queue.run_repeating(archive_old_orders, interval=ARCHIVE_INTERVAL, first=EXPIRY_SWEEP_INTERVAL)
+    if WORKERS > 1:
+        application.job_queue.run_repeating(refresh_subscriptions, interval=SUBSCRIPTION_REFRESH_INTERVAL, first=SUBSCRIPTION_REFRESH_INTERVAL)
+        application.job_queue.run_repeating(refresh_locations, interval=SUBSCRIPTION_REFRESH_INTERVAL, first=SUBSCRIPTION_REFRESH_INTERVAL)
+    return application
+
+# Explicit startup, importing this module touches neither the database nor the network:
+# check the schema version once (migrating only if it is behind), then build the
+# application. The 'initialize' phase ends in post_init.
+def bootstrap(worker_index: int = 0, updater: bool = True) -> Application:
+    with startup.phase('schema'):
+        version = setup_database()
+    if version < SCHEMA_VERSION:
+        logger.info("Migrated the database schema from version %s to %s", version, SCHEMA_VERSION)
+    with startup.phase('build'):
+        application = build_application(worker_index, updater)
+    startup.begin('initialize')
+    return application
+
+# Main function to set up and run the bot
+def main() -> None:
+    # Checked before logging and migrations start, so the error reaches the terminal and
+    # the process exits non-zero
+    if WEBHOOK_URL and not WEBHOOK_SECRET:
+        sys.exit("WEBHOOK_SECRET must be set when running with WEBHOOK_URL.")
+
+    setup_logging()
+    try:
+        application = bootstrap()
 
-    # Start the bot
-    print("Bot is running...")
-    application.run_polling()
+        # Start the bot, in webhook mode when WEBHOOK_URL is set
+        if WEBHOOK_URL:
+            print(f"Bot is running (webhook on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH})...")
+            application.run_webhook(
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                url_path=WEBHOOK_PATH,
+                webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET
+            )
+        else:
+            print("Bot is running...")
+            application.run_polling()
+    finally:
+        # Also on errors before the application's own shutdown ran, so they reach the log
+        stop_logging()
 
 if __name__ == '__main__':
     main()
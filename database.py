@@ -1,9 +1,89 @@
+import json
+import os
 import sqlite3
+import time
+from collections import OrderedDict
+from datetime import datetime
 
-def setup_database():
-    conn = sqlite3.connect('data/makanApa.db')
-    cursor = conn.cursor()
+from locations import location_key
 
+DB_PATH = 'data/makanApa.db'
+LEGACY_COUNTER_PATH = 'data/order_counter.json'
+STATEMENT_CACHE_SIZE = 128
+
+# Applied to every long-lived connection
+CONNECTION_PRAGMAS = (
+    # Takes effect on new databases only, and must come before WAL; archive.py converts older ones
+    "PRAGMA auto_vacuum=INCREMENTAL",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",     # ~16 MB page cache
+    "PRAGMA mmap_size=268435456",   # 256 MB memory-mapped I/O
+    "PRAGMA temp_store=MEMORY",
+)
+
+# Connection counters, read them to check the statement cache is doing its job
+stats = {
+    'connections_opened': 0,
+    'statements_executed': 0,
+    'statement_cache_hits': 0,
+}
+
+# Connection that mirrors sqlite3's LRU statement cache to count cache hits
+class CountingConnection(sqlite3.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._seen = OrderedDict()
+
+    def _track(self, sql):
+        stats['statements_executed'] += 1
+        if sql in self._seen:
+            self._seen.move_to_end(sql)
+            stats['statement_cache_hits'] += 1
+        else:
+            self._seen[sql] = None
+            if len(self._seen) > STATEMENT_CACHE_SIZE:
+                self._seen.popitem(last=False)
+
+    def execute(self, sql, parameters=(), /):
+        self._track(sql)
+        return super().execute(sql, parameters)
+
+    def executemany(self, sql, parameters, /):
+        self._track(sql)
+        return super().executemany(sql, parameters)
+
+# Open a tuned connection meant to be kept open for the life of the process
+def connect(db_path=DB_PATH):
+    conn = sqlite3.connect(db_path, factory=CountingConnection, cached_statements=STATEMENT_CACHE_SIZE)
+    conn.row_factory = sqlite3.Row
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    stats['connections_opened'] += 1
+    return conn
+
+
+# The one way Orders times are written: integer epoch milliseconds (UTC)
+def now_ms():
+    return int(time.time() * 1000)
+
+# Epoch milliseconds as local time for messages, e.g. 2024-01-31 13:05:00
+def format_ms(ms):
+    if ms is None:
+        return ''
+    return datetime.fromtimestamp(ms / 1000).strftime('%Y-%m-%d %H:%M:%S')
+
+# SQL turning an old text timestamp column into epoch milliseconds. order_time came
+# from CURRENT_TIMESTAMP (UTC); accept_time and cancelled_at were local time.
+def _text_to_ms_sql(column, local):
+    julian = f"julianday({column}, 'utc')" if local else f"julianday({column})"
+    return (f"CASE WHEN typeof({column}) = 'text' "
+            f"THEN CAST(ROUND(({julian} - 2440587.5) * 86400000) AS INTEGER) ELSE {column} END")
+
+TIME_COLUMNS = (('order_time', False), ('accept_time', True), ('cancelled_at', True))
+
+# Migration 1: the original tables plus the order number sequence
+def create_base_tables(cursor):
     # Create Customers table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS Customers (
@@ -44,14 +124,263 @@ def setup_database():
         )
     ''')
 
-    conn.commit()
-    conn.close()
+    # Create OrderSequence table, the source of the N in ORDER_yymmdd_HHMMSS_N
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS OrderSequence (
+            name VARCHAR(50) PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    ''')
+
+    # Continue numbering from the old order_counter.json if there is one
+    start = 0
+    if os.path.exists(LEGACY_COUNTER_PATH):
+        with open(LEGACY_COUNTER_PATH, 'r') as f:
+            start = json.load(f).get("count", 0)
+    cursor.execute("INSERT OR IGNORE INTO OrderSequence (name, value) VALUES ('orders', ?)", (start,))
+
+# Migration 2: indexes for status sweeps and per-customer/per-runner history
+def add_order_indexes(cursor):
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_status_time ON Orders (status, order_time)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_customer_time ON Orders (customer_id, order_time)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_runner_time ON Orders (runner_id, order_time)")
+
+# Migration 3: persisted conversation state and user_data, one small row per key
+def add_conversation_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ConversationStates (
+            name VARCHAR(50) NOT NULL,
+            key TEXT NOT NULL,
+            state INTEGER,
+            updated_at INTEGER NOT NULL,
+            PRIMARY KEY (name, key)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS UserData (
+            user_id BIGINT PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversation_states_updated ON ConversationStates (updated_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_data_updated ON UserData (updated_at)")
+
+# Migration 4: Orders times become epoch milliseconds and the duplicate `timestamp`
+# column goes. SQLite cannot change column types in place, so the table is rebuilt.
+def convert_order_times(cursor):
+    cursor.execute('''
+        CREATE TABLE Orders_new (
+            id VARCHAR(255) PRIMARY KEY,
+            customer_id BIGINT,
+            runner_id BIGINT,
+            delivery_type VARCHAR(50),
+            from_location TEXT,
+            to_location TEXT,
+            order_time INTEGER NOT NULL DEFAULT (CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER)),
+            status VARCHAR(50) DEFAULT 'pending',
+            accept_time INTEGER,
+            cancelled_at INTEGER,
+            customer_message_id BIGINT,
+            runner_message_id BIGINT,
+            FOREIGN KEY (customer_id) REFERENCES Customers(user_id),
+            FOREIGN KEY (runner_id) REFERENCES Runners(user_id)
+        )
+    ''')
+    cursor.execute(f'''
+        INSERT INTO Orders_new (id, customer_id, runner_id, delivery_type, from_location, to_location,
+                                order_time, status, accept_time, cancelled_at,
+                                customer_message_id, runner_message_id)
+        SELECT id, customer_id, runner_id, delivery_type, from_location, to_location,
+               {_text_to_ms_sql('order_time', False)}, status,
+               {_text_to_ms_sql('accept_time', True)}, {_text_to_ms_sql('cancelled_at', True)},
+               customer_message_id, runner_message_id
+        FROM Orders
+    ''')
+    cursor.execute("DROP TABLE Orders")
+    cursor.execute("ALTER TABLE Orders_new RENAME TO Orders")
+    add_order_indexes(cursor)
+
+# Migration 5: per-zone runner routing. Orders remember which chat holds their runner
+# message, OrderMessages keeps the copies DMed to zone subscribers, and
+# RunnerSubscriptions maps runners to the pickup zones they follow.
+def add_runner_routing(cursor):
+    cursor.execute("ALTER TABLE Orders ADD COLUMN runner_chat_id BIGINT")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS OrderMessages (
+            order_id VARCHAR(255) NOT NULL,
+            chat_id BIGINT NOT NULL,
+            message_id BIGINT NOT NULL,
+            PRIMARY KEY (order_id, chat_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS RunnerSubscriptions (
+            runner_id BIGINT NOT NULL,
+            zone VARCHAR(50) NOT NULL,
+            PRIMARY KEY (runner_id, zone)
+        ) WITHOUT ROWID
+    ''')
+
+# Migration 6: canonical locations. Locations holds one row per location key, seeded
+# from the typed history and named after its most used spelling; Orders point at them.
+def add_locations(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Locations (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            key TEXT NOT NULL UNIQUE,
+            uses INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute("ALTER TABLE Orders ADD COLUMN from_location_id INTEGER REFERENCES Locations(id)")
+    cursor.execute("ALTER TABLE Orders ADD COLUMN to_location_id INTEGER REFERENCES Locations(id)")
+    cursor.connection.create_function('location_key', 1, location_key, deterministic=True)
+    cursor.execute('''
+        INSERT INTO Locations (name, key, uses)
+        SELECT name, key, total FROM (
+            -- with MAX(), SQLite takes the bare `name` from the most used spelling
+            SELECT name, key, MAX(uses), SUM(uses) AS total FROM (
+                SELECT location AS name, location_key(location) AS key, COUNT(*) AS uses
+                FROM (SELECT from_location AS location FROM Orders UNION ALL SELECT to_location FROM Orders)
+                WHERE location IS NOT NULL
+                GROUP BY location
+            )
+            WHERE key != ''
+            GROUP BY key
+        )
+    ''')
+    cursor.execute('''
+        UPDATE Orders SET
+            from_location_id = (SELECT id FROM Locations WHERE key = location_key(Orders.from_location)),
+            to_location_id = (SELECT id FROM Locations WHERE key = location_key(Orders.to_location))
+    ''')
+
+# Migration 7: partial index over pending orders per customer, for the open order cap
+def add_pending_by_customer_index(cursor):
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_customer_pending ON Orders (customer_id) WHERE status = 'pending'")
+
+# Migration 8: order history pages by keyset on (order_time, id). The id tie-breaker
+# joins the per-customer and per-runner indexes, which it replaces.
+def add_history_indexes(cursor):
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_customer_time_id ON Orders (customer_id, order_time, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_runner_time_id ON Orders (runner_id, order_time, id)")
+    cursor.execute("DROP INDEX IF EXISTS idx_orders_customer_time")
+    cursor.execute("DROP INDEX IF EXISTS idx_orders_runner_time")
+
+# Schema migrations in order, PRAGMA user_version holds the last one applied.
+# Never edit an applied migration, append a new one instead.
+MIGRATIONS = [
+    (1, create_base_tables),
+    (2, add_order_indexes),
+    (3, add_conversation_tables),
+    (4, convert_order_times),
+    (5, add_runner_routing),
+    (6, add_locations),
+    (7, add_pending_by_customer_index),
+    (8, add_history_indexes),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+# Bring the schema up to date, returns the version it started from. An up to date
+# database costs one PRAGMA read; the write lock is only taken when a migration is due.
+def migrate(conn):
+    version = schema_version(conn)
+    if version >= SCHEMA_VERSION:
+        return version
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Another process may have migrated while we waited for the lock
+        version = schema_version(conn)
+        cursor = conn.cursor()
+        for target, migration in MIGRATIONS:
+            if target > version:
+                migration(cursor)
+                cursor.execute(f"PRAGMA user_version = {target}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return version
+
+# Called once at startup (bot.bootstrap(), `python database.py`), never on import
+def setup_database(db_path=DB_PATH):
+    conn = connect(db_path)
+    try:
+        return migrate(conn)
+    finally:
+        conn.close()
+
+# Convert text timestamps left behind by an older bot process (e.g. one still running
+# during a deploy) to epoch milliseconds, batch_size rows per transaction by rowid
+def backfill_timestamps(conn, batch_size=5000):
+    assignments = ', '.join(f"{column} = {_text_to_ms_sql(column, local)}" for column, local in TIME_COLUMNS)
+    pending = ' OR '.join(f"typeof({column}) = 'text'" for column, _ in TIME_COLUMNS)
+    last_rowid = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM Orders").fetchone()[0]
+    converted = 0
+    for start in range(0, last_rowid, batch_size):
+        cursor = conn.execute(
+            f"UPDATE Orders SET {assignments} WHERE rowid > ? AND rowid <= ? AND ({pending})",
+            (start, start + batch_size)
+        )
+        conn.commit()
+        converted += cursor.rowcount
+    return converted
+
+# Queries the bot runs on every update, each must SEARCH an index rather than scan a
+# table or a whole index
+HOT_QUERIES = {
+    'customer_lookup': "SELECT * FROM Customers WHERE user_id=?",
+    'order_fetch_join': '''
+        SELECT Orders.*, Customers.username
+        FROM Orders
+        JOIN Customers ON Orders.customer_id = Customers.user_id
+        WHERE Orders.id=?
+    ''',
+    # repository.transition_order, as accept_order and cancel_order run it
+    'order_accept': "UPDATE Orders SET status = ?, runner_id = ?, accept_time = ? WHERE id = ? AND status = ?",
+    'order_cancel': "UPDATE Orders SET status = ?, cancelled_at = ? WHERE id = ? AND status = ?",
+    'pending_by_age': "SELECT id FROM Orders WHERE status = ? AND order_time < ? ORDER BY order_time LIMIT ?",
+    'customer_pending_count': "SELECT COUNT(*) FROM Orders WHERE customer_id = ? AND status = 'pending'",
+    'customer_history': "SELECT id FROM Orders WHERE customer_id = ? ORDER BY order_time DESC",
+    'runner_history': "SELECT id FROM Orders WHERE runner_id = ? ORDER BY order_time DESC",
+    'customer_page_older': '''
+        SELECT * FROM Orders WHERE customer_id = ? AND (order_time, id) < (?, ?)
+        ORDER BY order_time DESC, id DESC LIMIT ?
+    ''',
+    'runner_page_newer': '''
+        SELECT * FROM Orders WHERE runner_id = ? AND (order_time, id) > (?, ?)
+        ORDER BY order_time, id LIMIT ?
+    ''',
+    'location_by_key': "SELECT id FROM Locations WHERE key = ?",
+    'order_copies': "SELECT order_id, chat_id, message_id FROM OrderMessages WHERE order_id IN (?, ?)",
+}
+
+# (query name, plan detail) of the scans HOT_QUERIES may make, none so far
+ALLOWED_SCANS = set()
 
-    # Create order_counter.json if not exists
-    import json, os
-    order_counter_path = 'data/order_counter.json'
-    if not os.path.exists(order_counter_path):
-        with open(order_counter_path, 'w') as f:
-            json.dump({"count": 0}, f)
+# Run EXPLAIN QUERY PLAN on every hot query, returns (name, plan detail) for each scan, a
+# full index scan (SCAN ... USING INDEX) included, and for each query that searches nothing
+def check_query_plans(conn):
+    regressions = []
+    for name, sql in HOT_QUERIES.items():
+        params = (None,) * sql.count('?')
+        details = [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        scans = [(name, detail) for detail in details if detail.startswith('SCAN ') and (name, detail) not in ALLOWED_SCANS]
+        if not scans and not any(detail.startswith('SEARCH ') for detail in details):
+            scans.append((name, '; '.join(details) or "no plan"))
+        regressions += scans
+    return regressions
 
-setup_database()
+if __name__ == '__main__':
+    import sys
+    version = setup_database()
+    if version < SCHEMA_VERSION:
+        print(f"Migrated the schema from version {version} to {SCHEMA_VERSION}.")
+    if sys.argv[1:] == ['backfill-timestamps']:
+        conn = connect()
+        print(f"Converted {backfill_timestamps(conn)} rows.")
+        conn.close()
@@ -0,0 +1,79 @@
+import time
+from collections import OrderedDict
+
+PAGE_SIZE = 5
+PAGE_CACHE_SIZE = 2000   # pages kept across all users
+PAGE_CACHE_TTL = 30      # seconds, bounds staleness from status changes made by other workers
+
+# /myorders lists the orders a user placed, /runs the ones they accepted as a runner
+ROLES = {'c': 'customer_id', 'r': 'runner_id'}
+
+STATUS_LABELS = {
+    'pending': "⏳ Pending",
+    'accepted': "✅ Accepted",
+    'cancelled': "❌ Cancelled",
+    'expired': "⌛ Expired",
+}
+
+
+# Callback data for the page next to a cursor row, e.g. "page_c_o_1700000000000_ORDER_...".
+# Order IDs contain underscores, so they come last.
+def page_button_data(role, older, order_time, order_id):
+    return f"page_{role}_{'o' if older else 'n'}_{order_time}_{order_id}"
+
+# (role, older, cursor) from page_button_data() output, None for data it could not
+# have produced (a tampered button or an unknown role)
+def parse_page_button(data):
+    try:
+        _, role, direction, order_time, order_id = data.split('_', 4)
+        order_time = int(order_time)
+    except ValueError:
+        return None
+    if role not in ROLES or direction not in ('o', 'n'):
+        return None
+    return role, direction == 'o', (order_time, order_id)
+
+
+# Recently shown history pages, least recently used first. Each page is also indexed by
+# user so a status change can drop all of that user's pages at once.
+class PageCache:
+    def __init__(self, max_pages=PAGE_CACHE_SIZE, ttl=PAGE_CACHE_TTL):
+        self.max_pages = max_pages
+        self.ttl = ttl
+        self._pages = OrderedDict()   # (role, user_id, cursor, older) -> (expires, page)
+        self._keys_by_user = {}       # (role, user_id) -> set of page keys
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def __len__(self):
+        return len(self._pages)
+
+    def get(self, key):
+        entry = self._pages.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self.stats['misses'] += 1
+            return None
+        self._pages.move_to_end(key)
+        self.stats['hits'] += 1
+        return entry[1]
+
+    def put(self, key, page):
+        self._pages[key] = (time.monotonic() + self.ttl, page)
+        self._pages.move_to_end(key)
+        self._keys_by_user.setdefault(key[:2], set()).add(key)
+        while len(self._pages) > self.max_pages:
+            self._forget(next(iter(self._pages)))
+
+    # Drop every cached page of one user's customer ('c') or runner ('r') history
+    def invalidate(self, role, user_id):
+        keys = self._keys_by_user.pop((role, user_id), ())
+        for key in keys:
+            del self._pages[key]
+        if keys:
+            self.stats['invalidations'] += 1
+
+    def _forget(self, key):
+        del self._pages[key]
+        keys = self._keys_by_user[key[:2]]
+        keys.discard(key)
+        if not keys:
+            del self._keys_by_user[key[:2]]
@@ -0,0 +1,125 @@
+import logging
+import re
+from bisect import bisect_left, insort
+
+logger = logging.getLogger(__name__)
+
+MATCH_LIMIT = 5          # suggestions offered as buttons
+MIN_SCORE = 0.5          # share of the query's words a suggestion must match
+PREFIX_LIMIT = 20        # known words tried for a query word that is a prefix
+MIN_WORD_SIMILARITY = 0.5
+
+_WORD = re.compile(r'\w+')
+
+
+# Canonical key of a location: case, punctuation and word order don't matter, so
+# "Cafe Zubair", "zubair cafe" and "Zubair, Cafe" share one key
+def location_key(text):
+    return ' '.join(sorted(_WORD.findall(text.casefold())))
+
+# Trigrams of a word, padded so the start of the word weighs more
+def trigrams(word):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# In-memory index over the known locations, by word. A typed word matches known words
+# exactly, as a prefix ("caf" -> "cafe") or, failing both, by trigram similarity
+# ("zubairr" -> "zubair"). Candidates come from the rarest query word only, so a lookup
+# touches a few posting lists and stays well under a millisecond at 100k names.
+class LocationIndex:
+    def __init__(self):
+        self.ids_by_key = {}
+        self.names = {}
+        self.uses = {}
+        self._location_words = {}
+        self._postings = {}      # word -> location IDs
+        self._word_grams = {}    # trigram -> words
+        self._sorted_words = []
+        self.last_loaded_id = 0  # highest ID read from the table; add() leaves it alone
+
+    def __len__(self):
+        return len(self.names)
+
+    # Fill the index from (id, name, key, uses) rows of the Locations table
+    def load(self, rows):
+        self._sorted_words = None
+        for location_id, name, key, uses in rows:
+            self.add(location_id, name, key, uses)
+            self.last_loaded_id = max(self.last_loaded_id, location_id)
+        self._sorted_words = sorted(self._postings)
+        logger.info("Location index holds %s locations, %s words", len(self.names), len(self._postings))
+
+    def add(self, location_id, name, key=None, uses=0):
+        key = key or location_key(name)
+        if location_id in self.names:
+            return
+        self.ids_by_key[key] = location_id
+        self.names[location_id] = name
+        self.uses[location_id] = uses
+        words = tuple(set(key.split()))
+        self._location_words[location_id] = words
+        for word in words:
+            postings = self._postings.get(word)
+            if postings is None:
+                postings = self._postings[word] = []
+                for gram in trigrams(word):
+                    self._word_grams.setdefault(gram, []).append(word)
+                if self._sorted_words is not None:
+                    insort(self._sorted_words, word)
+            postings.append(location_id)
+
+    def record_use(self, location_id):
+        self.uses[location_id] = self.uses.get(location_id, 0) + 1
+
+    # Location ID for text with the same canonical key, or None
+    def lookup(self, text):
+        return self.ids_by_key.get(location_key(text))
+
+    # Known words a typed word may stand for, {word: weight between 0 and 1}
+    def _expand(self, word):
+        expansions = {}
+        if word in self._postings:
+            expansions[word] = 1.0
+        words = self._sorted_words
+        position = bisect_left(words, word)
+        while position < len(words) and len(expansions) < PREFIX_LIMIT and words[position].startswith(word):
+            expansions.setdefault(words[position], len(word) / len(words[position]))
+            position += 1
+        if expansions:
+            return expansions
+
+        grams = trigrams(word)
+        shared = {}
+        for gram in grams:
+            for known in self._word_grams.get(gram, ()):
+                shared[known] = shared.get(known, 0) + 1
+        for known, count in shared.items():
+            similarity = count / (len(grams) + len(known) + 1 - count)
+            if similarity >= MIN_WORD_SIMILARITY:
+                expansions[known] = similarity
+        return expansions
+
+    # Up to `limit` (location_id, name, score) best matches for typed text, best first
+    # and the most used first among equals
+    def match(self, text, limit=MATCH_LIMIT):
+        query = location_key(text).split()
+        expanded = [self._expand(word) for word in query]
+        expanded = [expansions for expansions in expanded if expansions]
+        if not expanded:
+            return []
+
+        rarest = min(expanded, key=lambda expansions: sum(len(self._postings[word]) for word in expansions))
+        candidates = {location_id for word in rarest for location_id in self._postings[word]}
+        scored = []
+        for location_id in candidates:
+            words = self._location_words[location_id]
+            total = 0.0
+            for expansions in expanded:
+                total += max((expansions.get(word, 0.0) for word in words), default=0.0)
+            # Words the location has beyond the query count half, so prefixes still match
+            score = total / (len(query) + max(0, len(words) - len(query)) / 2)
+            if score >= MIN_SCORE:
+                scored.append((score, self.uses[location_id], location_id))
+        scored.sort(reverse=True)
+        return [(location_id, self.names[location_id], score) for score, _, location_id in scored[:limit]]
@@ -0,0 +1,105 @@
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+LOG_PATH = 'data/bot.log'
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+FLUSH_EVERY = 100        # records
+FLUSH_INTERVAL = 1.0     # seconds
+
+# Fields lifted from `extra=` into every JSON line when present
+CONTEXT_FIELDS = ('order_id', 'user_id')
+
+_listener = None
+
+
+# One JSON object per line, the message is only built here on the listener thread
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+# File handler that flushes every FLUSH_EVERY records or FLUSH_INTERVAL seconds, and right
+# away for errors so they are on disk even if the process dies next
+class BatchingFileHandler(logging.FileHandler):
+    def __init__(self, filename, flush_every=FLUSH_EVERY, flush_interval=FLUSH_INTERVAL):
+        super().__init__(filename, encoding='utf-8')
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def emit(self, record):
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+            self._pending += 1
+            if (record.levelno >= logging.ERROR or self._pending >= self.flush_every
+                    or time.monotonic() - self._last_flush >= self.flush_interval):
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        super().flush()
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+
+# Hands records to the listener untouched, so formatting happens off the event loop
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        return record
+
+
+# Route all logging through a queue to a background listener writing JSON lines to
+# log_path and plain text to stdout. Call stop_logging() on shutdown to drain it.
+def setup_logging(log_path=LOG_PATH, level=LOG_LEVEL):
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    file_handler = BatchingFileHandler(log_path)
+    file_handler.setFormatter(JsonFormatter())
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(LazyQueueHandler(records))
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(records, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+# Change the log level while the bot is running, e.g. set_level('DEBUG')
+def set_level(level):
+    logging.getLogger().setLevel(level)
+
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
@@ -0,0 +1,182 @@
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9471'))   # clear of node_exporter's 9100
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_registry = []
+
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.values = {}
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, key, value
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with _lock:
+            self.values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.values = {}
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[0][i] += 1
+            counts[1] += value
+            counts[2] += 1
+
+    def samples(self):
+        for key, (buckets, total, count) in self.values.items():
+            for bound, bucket_count in zip(self.buckets, buckets):
+                yield f'{self.name}_bucket', key + (('le', bound),), bucket_count
+            yield f'{self.name}_bucket', key + (('le', '+Inf'),), count
+            yield f'{self.name}_sum', key, total
+            yield f'{self.name}_count', key, count
+
+
+HANDLER_SECONDS = Histogram('makanapa_handler_seconds', 'Time spent in each update handler')
+HANDLER_ERRORS = Counter('makanapa_handler_errors_total', 'Handler calls that raised')
+DB_QUERY_SECONDS = Histogram('makanapa_db_query_seconds', 'Time spent running each repository query')
+BOT_API_SECONDS = Histogram('makanapa_bot_api_seconds', 'Bot API request time by method and status code')
+ORDERS = Gauge('makanapa_orders', 'Orders by status')
+OUTBOUND_DEPTH = Gauge('makanapa_outbound_queue_depth', 'Bot API calls waiting in the outbound queue')
+STARTUP_SECONDS = Gauge('makanapa_startup_seconds', 'Time spent in each startup phase')
+AUTH_CACHE = Gauge('makanapa_auth_cache', 'Authorization checks answered from memory or after a reload, and list reloads')
+DATABASE = Gauge('makanapa_database', 'Connections opened, statements run and statement cache hits, and repository calls waiting')
+PERSISTENCE = Gauge('makanapa_persistence', 'Conversation state flushes, records written and the last flush in milliseconds')
+PAGE_CACHE = Gauge('makanapa_page_cache', 'History pages served from memory or the database, and pages dropped')
+OUTBOUND_CALLS = Gauge('makanapa_outbound_calls', 'Bot API calls through the outbound queue sent, failed and retried')
+OUTBOUND_WAIT = Gauge('makanapa_outbound_wait_seconds', 'Average and longest time a call waited in the outbound queue')
+THROTTLED_UPDATES = Counter('makanapa_throttled_updates_total', 'Updates dropped by the per-user rate limiter')
+
+
+# Prometheus text exposition of every registered metric
+def render():
+    lines = []
+    with _lock:
+        for metric in _registry:
+            lines.append(f'# HELP {metric.name} {metric.help_text}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{_label_text(labels)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+# Record how long an update handler takes, keyed by its function name
+def timed_handler(handler):
+    name = handler.__name__
+
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        start = time.perf_counter()
+        try:
+            return await handler(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - start, handler=name)
+
+    return wrapper
+
+
+# HTTPXRequest that times every Bot API call by method and HTTP status code. The class
+# is built on first use: the repository imports this module, and importing telegram
+# (httpx included) would make up almost all of its import time.
+@functools.cache
+def _instrumented_request_class():
+    from telegram.request import HTTPXRequest
+
+    class InstrumentedRequest(HTTPXRequest):
+        async def do_request(self, url, method, *args, **kwargs):
+            api_method = url.rsplit('/', 1)[-1]
+            start = time.perf_counter()
+            status = 'error'
+            try:
+                status, payload = await super().do_request(url, method, *args, **kwargs)
+                return status, payload
+            finally:
+                BOT_API_SECONDS.observe(time.perf_counter() - start, method=api_method, status=status)
+
+    return InstrumentedRequest
+
+def instrumented_request(**kwargs):
+    return _instrumented_request_class()(**kwargs)
+
+
+# Minimal HTTP server for GET /metrics. `refresh` is awaited before each scrape to
+# update gauges that are read from the database.
+async def start_metrics_server(refresh=None, host=METRICS_HOST, port=METRICS_PORT):
+    async def handle(reader, writer):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()).strip():
+                pass
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1] == '/metrics':
+                if refresh is not None:
+                    await refresh()
+                body, status = render().encode(), '200 OK'
+            else:
+                body, status = b'Not Found\n', '404 Not Found'
+            writer.write(
+                f'HTTP/1.1 {status}\r\n'
+                'Content-Type: text/plain; version=0.0.4\r\n'
+                f'Content-Length: {len(body)}\r\n'
+                'Connection: close\r\n\r\n'.encode() + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.error("Metrics request failed: %s", e)
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info("Metrics served on http://%s:%s/metrics", host, port)
+    return server
@@ -0,0 +1,176 @@
+import asyncio
+import itertools
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows about 20 messages a minute into one group
+CHAT_RATE = float(os.getenv('CHAT_RATE_PER_MINUTE', '20')) / 60
+CHAT_BURST = 5
+MAX_RETRIES = 3
+
+# Outbound priorities, lower goes first
+PRIORITY_NEW_ORDER = 0
+PRIORITY_STATUS = 1
+PRIORITY_COSMETIC = 2
+
+
+# Await independent Bot API calls concurrently. A failing call is logged and returned
+# as its exception, it never cancels or aborts the others.
+async def dispatch(calls, order_id=None):
+    names = list(calls)
+    results = await asyncio.gather(*calls.values(), return_exceptions=True)
+    for name, result in zip(names, results):
+        if isinstance(result, Exception):
+            logger.error("Failed to %s for order ID: %s: %s", name, order_id, result, extra={'order_id': order_id})
+    return dict(zip(names, results))
+
+
+# Seconds Telegram asked us to back off for, or None if the error is not a flood limit
+def _retry_after(error):
+    retry_after = getattr(error, 'retry_after', None)
+    if retry_after is None:
+        return None
+    if hasattr(retry_after, 'total_seconds'):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class TokenBucket:
+    def __init__(self, rate=CHAT_RATE, capacity=CHAT_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    # Take a token if one is available, otherwise return the seconds until one is
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def drain(self):
+        self.tokens = 0
+        self.updated = time.monotonic()
+
+
+# Raised for sends queued or made after OutboundQueue.close()
+class OutboundClosed(Exception):
+    pass
+
+
+class _Lane:
+    def __init__(self, rate, capacity):
+        self.queue = asyncio.PriorityQueue()
+        self.bucket = TokenBucket(rate, capacity)
+        self.task = None
+        self.calls = set()        # calls started and not yet answered
+        self.paused_until = 0.0   # monotonic time a flood limit lifts
+
+
+# Throttled outbound sends. Each chat gets its own lane with a token bucket and a
+# priority queue, so new orders go out before edits and a 429 only pauses that chat.
+class OutboundQueue:
+    def __init__(self, rate=CHAT_RATE, capacity=CHAT_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self._lanes = {}
+        self._sequence = itertools.count()
+        self._waits = {'count': 0, 'total': 0.0, 'max': 0.0}
+        self.counters = {'sent': 0, 'failed': 0, 'retries': 0}
+        self._closed = False
+
+    # Queue a Bot API call for chat_id and wait for its result. `call` is a zero
+    # argument function returning a fresh coroutine, so it can be retried.
+    async def send(self, chat_id, call, priority=PRIORITY_STATUS):
+        if self._closed:
+            raise OutboundClosed(f"not sending to {chat_id}, the outbound queue is closed")
+        lane = self._lanes.get(chat_id)
+        if lane is None:
+            lane = self._lanes[chat_id] = _Lane(self.rate, self.capacity)
+        if lane.task is None:
+            lane.task = asyncio.create_task(self._drain(chat_id, lane))
+        future = asyncio.get_running_loop().create_future()
+        lane.queue.put_nowait((priority, next(self._sequence), call, future, time.monotonic(), 0))
+        return await future
+
+    # Start the lane's calls as fast as its bucket allows. A call is not waited for before
+    # the next one starts, so the lane's rate and not the Bot API round trip bounds it.
+    async def _drain(self, chat_id, lane):
+        while True:
+            item = await lane.queue.get()
+            if item[3].done():
+                continue
+            delay = max(lane.bucket.take(), lane.paused_until - time.monotonic())
+            try:
+                while delay > 0:
+                    await asyncio.sleep(delay)
+                    delay = max(lane.bucket.take(), lane.paused_until - time.monotonic())
+            except asyncio.CancelledError:
+                # close() cancelled the lane while this call waited for a token
+                if not item[3].done():
+                    item[3].set_exception(OutboundClosed(f"dropped on shutdown, chat {chat_id}"))
+                raise
+            lane.calls.add(asyncio.create_task(self._call(chat_id, lane, *item)))
+
+    async def _call(self, chat_id, lane, priority, sequence, call, future, enqueued, attempt):
+        waited = time.monotonic() - enqueued
+        try:
+            result = await call()
+        except Exception as e:
+            retry_after = _retry_after(e)
+            if retry_after is not None and attempt < MAX_RETRIES and not self._closed:
+                self.counters['retries'] += 1
+                logger.warning("Flood limit in chat %s, retrying in %ss", chat_id, retry_after)
+                lane.bucket.drain()
+                lane.paused_until = max(lane.paused_until, time.monotonic() + retry_after)
+                lane.queue.put_nowait((priority, sequence, call, future, enqueued, attempt + 1))
+                return
+            self.counters['failed'] += 1
+            if not future.done():
+                future.set_exception(e)
+        else:
+            self.counters['sent'] += 1
+            if not future.done():
+                future.set_result(result)
+        finally:
+            lane.calls.discard(asyncio.current_task())
+        self._record_wait(waited)
+
+    def _record_wait(self, waited):
+        self._waits['count'] += 1
+        self._waits['total'] += waited
+        self._waits['max'] = max(self._waits['max'], waited)
+
+    # Queue depth per chat, wait times in seconds and send counters
+    def stats(self):
+        count = self._waits['count']
+        return dict(
+            self.counters,
+            depth={chat_id: lane.queue.qsize() for chat_id, lane in self._lanes.items()},
+            wait_avg=self._waits['total'] / count if count else 0.0,
+            wait_max=self._waits['max'],
+        )
+
+    # Stop sending: refuse new sends and fail every queued one, so nothing awaiting them
+    # waits out the throttled backlog. Calls already on the wire are left to finish.
+    async def close(self):
+        self._closed = True
+        for chat_id, lane in self._lanes.items():
+            if lane.task is not None:
+                lane.task.cancel()
+            dropped = 0
+            while not lane.queue.empty():
+                future = lane.queue.get_nowait()[3]
+                if not future.done():
+                    future.set_exception(OutboundClosed(f"dropped on shutdown, chat {chat_id}"))
+                    dropped += 1
+            if dropped:
+                logger.warning("Dropped %s queued sends to chat %s on shutdown", dropped, chat_id)
+        self._lanes.clear()
@@ -0,0 +1,124 @@
+import asyncio
+import json
+import logging
+import time
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import repository
+from database import now_ms
+
+logger = logging.getLogger(__name__)
+
+CONVERSATION_TTL = 2 * 60 * 60   # seconds an unfinished order is kept
+FLUSH_INTERVAL = 5               # seconds between batched writes
+
+
+def _encode(value):
+    return json.dumps(value, separators=(',', ':'))
+
+
+# Keeps ConversationHandler states and user_data in SQLite so a restart does not drop
+# half-finished orders. The application hands over changes every FLUSH_INTERVAL seconds
+# and they are written in one transaction; records idle for longer than
+# CONVERSATION_TTL are evicted.
+class SQLitePersistence(BasePersistence):
+    def __init__(self, repo, ttl=CONVERSATION_TTL, flush_interval=FLUSH_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=flush_interval
+        )
+        self.repo = repo
+        self.ttl = ttl
+        self._dirty_states = {}
+        self._dirty_user_data = {}
+        self._last_seen = {}   # user_id -> monotonic time of the user's last update
+        self._flush_task = None
+        self._flush_lock = asyncio.Lock()
+        self.stats = {'flushes': 0, 'records_written': 0, 'last_flush_ms': 0.0}
+
+    def _cutoff(self):
+        return now_ms() - int(self.ttl * 1000)
+
+    async def get_conversations(self, name):
+        rows = await self.repo.run(repository.load_conversations, name, self._cutoff())
+        return {tuple(json.loads(key)): state for key, state in rows}
+
+    async def get_user_data(self):
+        rows = await self.repo.run(repository.load_user_data, self._cutoff())
+        now = time.monotonic()
+        self._last_seen.update((user_id, now) for user_id, _ in rows)
+        return {user_id: json.loads(data) for user_id, data in rows}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_conversation(self, name, key, new_state):
+        self._dirty_states[(name, _encode(list(key)))] = new_state
+        self._schedule_flush()
+
+    async def update_user_data(self, user_id, data):
+        self._dirty_user_data[user_id] = _encode(data)
+        self._last_seen[user_id] = time.monotonic()
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id):
+        self._dirty_user_data[user_id] = None
+        self._last_seen.pop(user_id, None)
+        self._schedule_flush()
+
+    # Users without an update for the TTL. The application hands over every user with an
+    # update each round, so their user_data can go from memory (Application.drop_user_data).
+    def idle_users(self):
+        cutoff = time.monotonic() - self.ttl
+        return [user_id for user_id, seen in self._last_seen.items() if seen < cutoff]
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    # Let the rest of the application's update round buffer its changes first
+    async def _flush_later(self):
+        await asyncio.sleep(0)
+        await self.flush()
+
+    # Write every buffered change in a single transaction
+    async def flush(self):
+        async with self._flush_lock:
+            states, self._dirty_states = self._dirty_states, {}
+            user_data, self._dirty_user_data = self._dirty_user_data, {}
+            if not states and not user_data:
+                return
+            start = time.perf_counter()
+            await self.repo.run(repository.write_conversation_batch, states, user_data, now_ms(), self._cutoff())
+            self.stats['flushes'] += 1
+            self.stats['records_written'] += len(states) + len(user_data)
+            self.stats['last_flush_ms'] = (time.perf_counter() - start) * 1000
+            logger.debug("Flushed %s conversation states and %s user_data records", len(states), len(user_data))
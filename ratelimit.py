@@ -0,0 +1,55 @@
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from notifications import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Updates one user may send, sustained and in a burst, before the rest are dropped
+USER_RATE = float(os.getenv('USER_RATE_PER_MINUTE', '30')) / 60
+USER_BURST = int(os.getenv('USER_BURST', '8'))
+# Pending orders one customer may have open at once
+MAX_PENDING_ORDERS = int(os.getenv('MAX_PENDING_ORDERS', '3'))
+# Buckets untouched this long are full again, so they are dropped from memory
+BUCKET_IDLE_TTL = 600
+
+ALLOWED = 'allowed'
+THROTTLED = 'throttled'  # first update dropped since the user was last allowed
+DROPPED = 'dropped'
+
+
+# Per-user token buckets, kept in least recently used order so idle buckets can be
+# evicted from the front without walking the rest
+class UserRateLimiter:
+    def __init__(self, rate=USER_RATE, burst=USER_BURST, idle_ttl=BUCKET_IDLE_TTL):
+        self.rate = rate
+        self.burst = burst
+        self.idle_ttl = idle_ttl
+        self._buckets = OrderedDict()  # user_id -> (bucket, warned)
+        self.stats = {'allowed': 0, 'dropped': 0, 'evicted': 0}
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def check(self, user_id):
+        now = time.monotonic()
+        self._evict(now)
+        entry = self._buckets.pop(user_id, None)
+        bucket, warned = entry if entry is not None else (TokenBucket(self.rate, self.burst), False)
+        if bucket.take() == 0:
+            self._buckets[user_id] = (bucket, False)
+            self.stats['allowed'] += 1
+            return ALLOWED
+        self._buckets[user_id] = (bucket, True)
+        self.stats['dropped'] += 1
+        return DROPPED if warned else THROTTLED
+
+    def _evict(self, now):
+        while self._buckets:
+            user_id, (bucket, _) = next(iter(self._buckets.items()))
+            if now - bucket.updated < self.idle_ttl:
+                break
+            del self._buckets[user_id]
+            self.stats['evicted'] += 1
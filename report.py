@@ -0,0 +1,150 @@
+import argparse
+import csv
+import os
+import sqlite3
+import sys
+from datetime import datetime
+
+from archive import archive_path, attach_archive, create_unified_view
+from database import DB_PATH, SCHEMA_VERSION, schema_version
+
+CHUNK_SIZE = 5000
+
+# Seconds from order to acceptance, times are epoch milliseconds
+ACCEPT_LATENCY = "(accept_time - order_time) / 1000.0"
+
+# Local calendar buckets for an epoch milliseconds column
+def _local(column, fmt):
+    return f"strftime('{fmt}', {column} / 1000, 'unixepoch', 'localtime')"
+
+# Every report is one aggregate query; :since and :until bound order_time (epoch ms).
+# AllOrders covers the hot Orders table and the archive, aliased so columns read the same.
+REPORTS = {
+    'orders-per-hour': f'''
+        SELECT {_local('order_time', '%Y-%m-%d %H:00')} AS hour,
+               COUNT(*) AS orders,
+               SUM(status = 'accepted') AS accepted,
+               SUM(status = 'cancelled') AS cancelled,
+               SUM(status = 'expired') AS expired
+        FROM AllOrders AS Orders
+        WHERE order_time >= :since AND order_time < :until
+        GROUP BY hour
+        ORDER BY hour
+    ''',
+    'acceptance-latency': f'''
+        SELECT {_local('order_time', '%Y-%m-%d')} AS day,
+               COUNT(*) AS accepted,
+               ROUND(AVG({ACCEPT_LATENCY}), 1) AS avg_seconds,
+               ROUND(MIN({ACCEPT_LATENCY}), 1) AS min_seconds,
+               ROUND(MAX({ACCEPT_LATENCY}), 1) AS max_seconds
+        FROM AllOrders AS Orders
+        WHERE status = 'accepted' AND order_time >= :since AND order_time < :until
+        GROUP BY day
+        ORDER BY day
+    ''',
+    'runner-leaderboard': f'''
+        SELECT Orders.runner_id, Runners.username,
+               COUNT(*) AS orders,
+               ROUND(AVG({ACCEPT_LATENCY}), 1) AS avg_accept_seconds
+        FROM AllOrders AS Orders
+        LEFT JOIN Runners ON Orders.runner_id = Runners.user_id
+        WHERE Orders.status = 'accepted' AND order_time >= :since AND order_time < :until
+        GROUP BY Orders.runner_id
+        ORDER BY orders DESC
+    ''',
+    # Grouped by canonical pickup location, so spelling variants count together
+    'cancellation-rates': '''
+        SELECT COALESCE(Locations.name, Orders.from_location) AS from_location,
+               COUNT(*) AS orders,
+               SUM(status = 'cancelled') AS cancelled,
+               ROUND(100.0 * SUM(status = 'cancelled') / COUNT(*), 1) AS cancel_rate
+        FROM AllOrders AS Orders
+        LEFT JOIN Locations ON Orders.from_location_id = Locations.id
+        WHERE order_time >= :since AND order_time < :until
+        GROUP BY COALESCE(Orders.from_location_id, Orders.from_location)
+        ORDER BY orders DESC
+    ''',
+}
+
+
+# Local date or datetime given on the command line to epoch milliseconds
+def _parse_ms(value):
+    return int(datetime.fromisoformat(value).timestamp() * 1000)
+
+# Read-only connection: never takes the write lock, and under WAL it reads a
+# consistent snapshot without blocking the bot. The archive is attached when there is
+# one; the AllOrders view lives in temp, so it is created before query_only.
+def connect_read_only(db_path=DB_PATH):
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    if os.path.exists(archive_path(db_path)):
+        attach_archive(conn, archive_path(db_path), read_only=True)
+    create_unified_view(conn)
+    conn.execute("PRAGMA query_only = ON")
+    return conn
+
+# Yield the column names, then rows in chunks of CHUNK_SIZE
+def stream_report(conn, name, since, until):
+    cursor = conn.execute(REPORTS[name], {'since': since, 'until': until})
+    yield [column[0] for column in cursor.description]
+    while True:
+        rows = cursor.fetchmany(CHUNK_SIZE)
+        if not rows:
+            break
+        yield rows
+
+def write_csv(chunks, output):
+    writer = csv.writer(output)
+    writer.writerow(next(chunks))
+    for rows in chunks:
+        writer.writerows(rows)
+
+# Columnar output, one Parquet row group per chunk. Needs pyarrow.
+def write_parquet(chunks, path):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        sys.exit("Parquet output needs pyarrow: pip install pyarrow")
+
+    columns = next(chunks)
+    writer = None
+    for rows in chunks:
+        table = pa.table({column: [row[i] for row in rows] for i, column in enumerate(columns)})
+        if writer is None:
+            writer = pq.ParquetWriter(path, table.schema)
+        writer.write_table(table.cast(writer.schema))
+    if writer is not None:
+        writer.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Throughput reports over the Orders table.")
+    parser.add_argument('report', choices=sorted(REPORTS))
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--since', type=_parse_ms, default=0, help="first order_time included, e.g. 2024-01-01")
+    parser.add_argument('--until', type=_parse_ms, default=2 ** 62, help="first order_time excluded")
+    parser.add_argument('--format', choices=('csv', 'parquet'), default='csv')
+    parser.add_argument('--output', help="output file, CSV goes to stdout by default")
+    args = parser.parse_args(argv)
+
+    # Reports never migrate, the bot or `python database.py` does that
+    if not os.path.exists(args.db):
+        parser.error(f"{args.db} does not exist")
+    conn = connect_read_only(args.db)
+    try:
+        if schema_version(conn) < SCHEMA_VERSION:
+            parser.error(f"{args.db} has an old schema, run `python database.py` to migrate it")
+        chunks = stream_report(conn, args.report, args.since, args.until)
+        if args.format == 'parquet':
+            if not args.output:
+                parser.error("--output is required for parquet")
+            write_parquet(chunks, args.output)
+        elif args.output:
+            with open(args.output, 'w', newline='') as f:
+                write_csv(chunks, f)
+        else:
+            write_csv(chunks, sys.stdout)
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
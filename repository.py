@@ -0,0 +1,388 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+
+import database
+import metrics
+from locations import location_key
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = database.DB_PATH
+MAX_PENDING_JOBS = 1000
+ORDER_ID_BLOCK_SIZE = 50
+
+_STOP = object()
+
+
+# Query functions, each runs on the repository thread with its connection
+def fetch_customer(conn, user_id):
+    cursor = conn.execute("SELECT * FROM Customers WHERE user_id=?", (user_id,))
+    return cursor.fetchone()
+
+def fetch_blocked_user_ids(conn):
+    cursor = conn.execute("SELECT user_id FROM Customers WHERE is_blocked")
+    return {row['user_id'] for row in cursor}
+
+# Block or unblock a customer, registering them first if they never used the bot
+def set_customer_blocked(conn, user_id, blocked):
+    conn.execute("INSERT OR IGNORE INTO Customers (user_id) VALUES (?)", (user_id,))
+    conn.execute("UPDATE Customers SET is_blocked = ? WHERE user_id = ?", (bool(blocked), user_id))
+    conn.commit()
+
+def ensure_customer(conn, user_id, username):
+    customer = fetch_customer(conn, user_id)
+    if not customer:
+        conn.execute("INSERT INTO Customers (user_id, username) VALUES (?, ?)", (user_id, username))
+        conn.commit()
+        logger.debug("New customer inserted: user_id=%s, username=%s", user_id, username)
+
+# Location ID for a name, adding the location if its key is new. None for names
+# without any words.
+def ensure_location(conn, name):
+    key = location_key(name)
+    if not key:
+        return None
+    row = conn.execute("SELECT id FROM Locations WHERE key = ?", (key,)).fetchone()
+    if row:
+        return row['id']
+    return conn.execute("INSERT INTO Locations (name, key) VALUES (?, ?)", (name, key)).lastrowid
+
+# Insert an order with its canonical locations, returns (from_location_id, to_location_id)
+def insert_order(conn, order_id, customer_id, delivery_type, from_location, to_location, order_time):
+    from_location_id = ensure_location(conn, from_location)
+    to_location_id = ensure_location(conn, to_location)
+    conn.execute("UPDATE Locations SET uses = uses + 1 WHERE id IN (?, ?)", (from_location_id, to_location_id))
+    conn.execute('''
+        INSERT INTO Orders (id, customer_id, delivery_type, from_location, to_location, order_time,
+                            from_location_id, to_location_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (order_id, customer_id, delivery_type, from_location, to_location, order_time, from_location_id, to_location_id))
+    conn.commit()
+    return from_location_id, to_location_id
+
+# Record where an order was posted: the customer's message, the runner channel message
+# and any (chat_id, message_id) copies sent to zone subscribers
+def update_message_ids(conn, order_id, customer_message_id, runner_chat_id, runner_message_id, copies=()):
+    conn.execute('''
+        UPDATE Orders
+        SET customer_message_id = ?, runner_chat_id = ?, runner_message_id = ?
+        WHERE id = ?
+    ''', (customer_message_id, runner_chat_id, runner_message_id, order_id))
+    conn.executemany(
+        "INSERT OR REPLACE INTO OrderMessages (order_id, chat_id, message_id) VALUES (?, ?, ?)",
+        [(order_id, chat_id, message_id) for chat_id, message_id in copies]
+    )
+    conn.commit()
+
+# Subscriber copies of each order, {order_id: [(chat_id, message_id), ...]}
+def fetch_order_copies(conn, order_ids):
+    copies = {order_id: [] for order_id in order_ids}
+    if order_ids:
+        placeholders = ','.join('?' * len(order_ids))
+        cursor = conn.execute(
+            f"SELECT order_id, chat_id, message_id FROM OrderMessages WHERE order_id IN ({placeholders})",
+            list(order_ids)
+        )
+        for row in cursor:
+            copies[row['order_id']].append((row['chat_id'], row['message_id']))
+    return copies
+
+def fetch_order(conn, order_id):
+    cursor = conn.execute('''
+        SELECT Orders.*, Customers.username
+        FROM Orders
+        JOIN Customers ON Orders.customer_id = Customers.user_id
+        WHERE Orders.id=?
+    ''', (order_id,))
+    return cursor.fetchone()
+
+# One page of a customer's or runner's orders, newest first, by keyset on (order_time, id)
+# so a deep page costs the same as the first. From `cursor`, an (order_time, id) pair, it
+# reads the older orders or, with older=False, the newer ones. Returns the rows and
+# whether there are more in that direction.
+def fetch_order_page(conn, column, user_id, cursor=None, older=True, limit=10):
+    sql = f"SELECT id, status, delivery_type, from_location, to_location, order_time FROM Orders WHERE {column} = ?"
+    params = [user_id]
+    if cursor is not None:
+        sql += f" AND (order_time, id) {'<' if older else '>'} (?, ?)"
+        params.extend(cursor)
+    sql += " ORDER BY order_time DESC, id DESC LIMIT ?" if older else " ORDER BY order_time, id LIMIT ?"
+    rows = conn.execute(sql, (*params, limit + 1)).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if not older:
+        rows.reverse()
+    return rows, more
+
+def count_orders_by_status(conn):
+    cursor = conn.execute("SELECT status, COUNT(*) AS orders FROM Orders GROUP BY status")
+    return {row['status']: row['orders'] for row in cursor}
+
+# Pending orders of one customer, counted from idx_orders_customer_pending alone
+def count_pending_orders(conn, customer_id):
+    cursor = conn.execute("SELECT COUNT(*) FROM Orders WHERE customer_id = ? AND status = 'pending'", (customer_id,))
+    return cursor.fetchone()[0]
+
+# Move an order from one status to another in a single conditional UPDATE.
+# Returns False when the order is missing or another update got there first.
+def transition_order(conn, order_id, from_status, to_status, **fields):
+    assignments = ''.join(f", {column} = ?" for column in fields)
+    cursor = conn.execute(
+        f"UPDATE Orders SET status = ?{assignments} WHERE id = ? AND status = ?",
+        (to_status, *fields.values(), order_id, from_status)
+    )
+    return cursor.rowcount == 1
+
+# Cancel a pending order, returns the order row or None if it was not pending
+def cancel_order(conn, order_id, cancelled_at):
+    if not transition_order(conn, order_id, 'pending', 'cancelled', cancelled_at=cancelled_at):
+        conn.rollback()
+        return None
+    order = fetch_order(conn, order_id)
+    conn.commit()
+    return order
+
+# Accept a pending order for a runner, registering the runner if new.
+# Returns the order row, or None for every runner but the first.
+def accept_order(conn, order_id, runner_id, runner_username, accept_time):
+    if not transition_order(conn, order_id, 'pending', 'accepted', runner_id=runner_id, accept_time=accept_time):
+        conn.rollback()
+        return None
+    runner_record = conn.execute("SELECT * FROM Runners WHERE user_id=?", (runner_id,)).fetchone()
+    if not runner_record:
+        conn.execute("INSERT INTO Runners (user_id, username) VALUES (?, ?)", (runner_id, runner_username))
+        logger.debug("New runner inserted: user_id=%s, username=%s", runner_id, runner_username)
+    order = fetch_order(conn, order_id)
+    conn.commit()
+    return order
+
+# Expire up to `limit` pending orders placed before `cutoff` (epoch ms) in one
+# transaction, oldest first, and return them. Walks idx_orders_status_time only.
+def expire_pending_orders(conn, cutoff, limit):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        orders = conn.execute('''
+            SELECT id, customer_id, delivery_type, from_location, to_location, order_time,
+                   customer_message_id, runner_chat_id, runner_message_id
+            FROM Orders
+            WHERE status = 'pending' AND order_time < ?
+            ORDER BY order_time
+            LIMIT ?
+        ''', (cutoff, limit)).fetchall()
+        if orders:
+            placeholders = ','.join('?' * len(orders))
+            conn.execute(
+                f"UPDATE Orders SET status = 'expired' WHERE status = 'pending' AND id IN ({placeholders})",
+                [order['id'] for order in orders]
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return orders
+
+# Reserve the next `count` order numbers, returns the half-open range [first, limit)
+def lease_order_numbers(conn, count):
+    conn.execute("UPDATE OrderSequence SET value = value + ? WHERE name = 'orders'", (count,))
+    end = conn.execute("SELECT value FROM OrderSequence WHERE name = 'orders'").fetchone()['value']
+    conn.commit()
+    return end - count + 1, end + 1
+
+# Locations in ID order, only those added after `after_id` if given
+def fetch_locations(conn, after_id=0):
+    cursor = conn.execute("SELECT id, name, key, uses FROM Locations WHERE id > ? ORDER BY id", (after_id,))
+    return [(row['id'], row['name'], row['key'], row['uses']) for row in cursor]
+
+def fetch_subscriptions(conn):
+    cursor = conn.execute("SELECT runner_id, zone FROM RunnerSubscriptions")
+    return [(row['runner_id'], row['zone']) for row in cursor]
+
+def add_subscription(conn, runner_id, zone):
+    conn.execute("INSERT OR IGNORE INTO RunnerSubscriptions (runner_id, zone) VALUES (?, ?)", (runner_id, zone))
+    conn.commit()
+
+def remove_subscription(conn, runner_id, zone):
+    conn.execute("DELETE FROM RunnerSubscriptions WHERE runner_id = ? AND zone = ?", (runner_id, zone))
+    conn.commit()
+
+
+# Drop persisted conversations idle since before `cutoff` and return the rest
+def load_conversations(conn, name, cutoff):
+    conn.execute("DELETE FROM ConversationStates WHERE updated_at < ?", (cutoff,))
+    conn.commit()
+    cursor = conn.execute("SELECT key, state FROM ConversationStates WHERE name = ?", (name,))
+    return [(row['key'], row['state']) for row in cursor]
+
+def load_user_data(conn, cutoff):
+    conn.execute("DELETE FROM UserData WHERE updated_at < ?", (cutoff,))
+    conn.commit()
+    cursor = conn.execute("SELECT user_id, data FROM UserData")
+    return [(row['user_id'], row['data']) for row in cursor]
+
+# Write a batch of dirty conversation records in one transaction and evict idle ones.
+# A state or data of None deletes the record.
+def write_conversation_batch(conn, states, user_data, now, cutoff):
+    conn.executemany('''
+        INSERT INTO ConversationStates (name, key, state, updated_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT (name, key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+    ''', [(name, key, state, now) for (name, key), state in states.items() if state is not None])
+    conn.executemany(
+        "DELETE FROM ConversationStates WHERE name = ? AND key = ?",
+        [(name, key) for (name, key), state in states.items() if state is None]
+    )
+    conn.executemany('''
+        INSERT INTO UserData (user_id, data, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+    ''', [(user_id, data, now) for user_id, data in user_data.items() if data is not None])
+    conn.executemany(
+        "DELETE FROM UserData WHERE user_id = ?",
+        [(user_id,) for user_id, data in user_data.items() if data is None]
+    )
+    conn.execute("DELETE FROM ConversationStates WHERE updated_at < ?", (cutoff,))
+    conn.execute("DELETE FROM UserData WHERE updated_at < ?", (cutoff,))
+    conn.commit()
+
+
+def _set_result(future, result):
+    if not future.done():
+        future.set_result(result)
+
+def _set_exception(future, exc):
+    if not future.done():
+        future.set_exception(exc)
+
+
+# Runs all SQLite work on a single dedicated thread so handlers never block the event loop.
+# Jobs are queued in order; at most max_pending jobs may be in flight before callers wait.
+class Repository:
+    def __init__(self, db_path=DB_PATH, max_pending=MAX_PENDING_JOBS, id_block_size=ORDER_ID_BLOCK_SIZE):
+        self.db_path = db_path
+        self.max_pending = max_pending
+        self.id_block_size = id_block_size
+        self._jobs = queue.Queue()
+        self._slots = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._next_number = 0
+        self._number_limit = 0
+        self._lease_lock = asyncio.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name='db-writer', daemon=True)
+                self._thread.start()
+                logger.info("Repository thread started for %s", self.db_path)
+
+    def close(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._jobs.put(_STOP)
+            thread.join()
+            logger.info("Repository thread stopped.")
+
+    def _worker(self):
+        conn = database.connect(self.db_path)
+        try:
+            while True:
+                job = self._jobs.get()
+                if job is _STOP:
+                    break
+                func, args, loop, future = job
+                start = time.perf_counter()
+                try:
+                    result = func(conn, *args)
+                except Exception as e:
+                    conn.rollback()
+                    loop.call_soon_threadsafe(_set_exception, future, e)
+                else:
+                    loop.call_soon_threadsafe(_set_result, future, result)
+                metrics.DB_QUERY_SECONDS.observe(time.perf_counter() - start, query=func.__name__)
+        finally:
+            conn.close()
+
+    # Queue a query function and wait for its result without blocking the event loop
+    async def run(self, func, *args):
+        self.start()
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._jobs.put((func, args, loop, future))
+            return await future
+
+    # Connection and statement cache counters plus current queue depth
+    def stats(self):
+        return dict(database.stats, queue_depth=self._jobs.qsize())
+
+    # Hand out order numbers from an in-memory block leased from OrderSequence.
+    # Leases are atomic in SQLite, so numbers stay unique across processes; a restart
+    # only skips the unused remainder of the current block.
+    async def next_order_number(self):
+        if self._next_number >= self._number_limit:
+            async with self._lease_lock:
+                if self._next_number >= self._number_limit:
+                    self._next_number, self._number_limit = await self.run(lease_order_numbers, self.id_block_size)
+                    logger.debug("Leased order numbers %s-%s", self._next_number, self._number_limit - 1)
+        number = self._next_number
+        self._next_number += 1
+        return number
+
+    async def get_customer(self, user_id):
+        return await self.run(fetch_customer, user_id)
+
+    async def get_blocked_user_ids(self):
+        return await self.run(fetch_blocked_user_ids)
+
+    async def set_blocked(self, user_id, blocked):
+        await self.run(set_customer_blocked, user_id, blocked)
+
+    async def ensure_customer(self, user_id, username):
+        await self.run(ensure_customer, user_id, username)
+
+    async def create_order(self, order_id, customer_id, delivery_type, from_location, to_location, order_time):
+        return await self.run(insert_order, order_id, customer_id, delivery_type, from_location, to_location, order_time)
+
+    async def set_message_ids(self, order_id, customer_message_id, runner_chat_id, runner_message_id, copies=()):
+        await self.run(update_message_ids, order_id, customer_message_id, runner_chat_id, runner_message_id, copies)
+
+    async def get_order_copies(self, order_ids):
+        return await self.run(fetch_order_copies, order_ids)
+
+    async def get_order(self, order_id):
+        return await self.run(fetch_order, order_id)
+
+    async def get_order_page(self, column, user_id, cursor=None, older=True, limit=10):
+        return await self.run(fetch_order_page, column, user_id, cursor, older, limit)
+
+    async def count_orders_by_status(self):
+        return await self.run(count_orders_by_status)
+
+    async def count_pending_orders(self, customer_id):
+        return await self.run(count_pending_orders, customer_id)
+
+    async def expire_pending_orders(self, cutoff, limit):
+        return await self.run(expire_pending_orders, cutoff, limit)
+
+    async def cancel_order(self, order_id, cancelled_at):
+        return await self.run(cancel_order, order_id, cancelled_at)
+
+    async def accept_order(self, order_id, runner_id, runner_username, accept_time):
+        return await self.run(accept_order, order_id, runner_id, runner_username, accept_time)
+
+    async def get_locations(self, after_id=0):
+        return await self.run(fetch_locations, after_id)
+
+    async def get_subscriptions(self):
+        return await self.run(fetch_subscriptions)
+
+    async def subscribe(self, runner_id, zone):
+        await self.run(add_subscription, runner_id, zone)
+
+    async def unsubscribe(self, runner_id, zone):
+        await self.run(remove_subscription, runner_id, zone)
@@ -0,0 +1,69 @@
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Pickup zones, the same keys the PICKUP location buttons use
+ZONES = ('sister', 'brother', 'in_uia', 'outside_uia')
+ZONE_NAMES = {
+    'sister': "Sister Mahallah",
+    'brother': "Brother Mahallah",
+    'in_uia': "In UIA",
+    'outside_uia': "Outside UIA",
+}
+
+
+# Numeric chat IDs as ints so they match message.chat_id and the values stored in
+# SQLite, @channel usernames stay strings
+def as_chat_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+# RUNNER_ZONE_CHATS="sister:-100123,brother:-100456" gives zones their own runner channel
+def parse_zone_chats(value):
+    zone_chats = {}
+    for entry in filter(None, (part.strip() for part in (value or '').split(','))):
+        zone, _, chat_id = entry.partition(':')
+        if zone not in ZONES or not chat_id:
+            raise ValueError(f"Bad RUNNER_ZONE_CHATS entry: {entry!r}")
+        zone_chats[zone] = as_chat_id(chat_id)
+    return zone_chats
+
+
+# Decides where a new order is posted: the channel for its pickup zone (or the main
+# runner group) plus a DM to every runner subscribed to that zone. Subscriptions are
+# kept in memory, so routing an order is a couple of dict lookups.
+class OrderRouter:
+    def __init__(self, default_chat_id, zone_chats=None):
+        self.default_chat_id = as_chat_id(default_chat_id)
+        self.zone_chats = zone_chats if zone_chats is not None else parse_zone_chats(os.getenv('RUNNER_ZONE_CHATS'))
+        # Group and channel chats orders are posted to, the ones Telegram rate limits tightly
+        self.runner_chats = {self.default_chat_id, *self.zone_chats.values()}
+        self.subscribers = {zone: set() for zone in ZONES}
+
+    # Fill the index from (runner_id, zone) rows stored in RunnerSubscriptions
+    def load(self, rows):
+        for subscribers in self.subscribers.values():
+            subscribers.clear()
+        for runner_id, zone in rows:
+            if zone in self.subscribers:
+                self.subscribers[zone].add(runner_id)
+        logger.info("Loaded %s runner subscriptions", sum(len(s) for s in self.subscribers.values()))
+
+    def chat_for(self, zone):
+        return self.zone_chats.get(zone, self.default_chat_id)
+
+    def subscribers_for(self, zone):
+        return self.subscribers.get(zone, ())
+
+    def subscribe(self, runner_id, zone):
+        self.subscribers[zone].add(runner_id)
+
+    def unsubscribe(self, runner_id, zone):
+        self.subscribers[zone].discard(runner_id)
+
+    def zones_of(self, runner_id):
+        return [zone for zone in ZONES if runner_id in self.subscribers[zone]]
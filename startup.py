@@ -0,0 +1,36 @@
+import time
+from contextlib import contextmanager
+
+
+# Wall-clock time of each startup phase. bot.py imports this module before anything
+# else, so the clock starts with its imports, and logs the breakdown once it is ready.
+class StartupTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self._open = {}
+
+    def begin(self, name):
+        self._open[name] = time.perf_counter()
+
+    def end(self, name):
+        self.phases[name] = time.perf_counter() - self._open.pop(name)
+
+    @contextmanager
+    def phase(self, name):
+        self.begin(name)
+        try:
+            yield
+        finally:
+            self.end(name)
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def summary(self):
+        phases = ', '.join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.phases.items())
+        return f"Started in {self.total() * 1000:.0f} ms ({phases})"
+
+
+timer = StartupTimer()
+timer.begin('imports')
@@ -0,0 +1,143 @@
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+WORKER_CHECK_INTERVAL = 5  # seconds between checks for dead workers
+
+
+# Updates from one chat always go to the same worker, so a customer's conversation and
+# the order of their updates stay inside one process
+def partition(update, workers):
+    chat = update.effective_chat or update.effective_user
+    return chat.id % workers if chat is not None else 0
+
+# Per-worker log file, e.g. data/bot.log becomes data/bot.worker1.log
+def worker_log_path(log_path, index):
+    root, ext = os.path.splitext(log_path)
+    return f"{root}.worker{index}{ext}"
+
+
+# Worker process: runs the full application without an updater and processes the
+# updates the front process puts in `inbox` until it gets None
+def run_worker(index, inbox):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    import bot
+    import logging_setup
+    from telegram import Update
+
+    async def serve():
+        application = bot.bootstrap(worker_index=index, updater=False)
+        await application.initialize()
+        await application.post_init(application)
+        await application.start()
+        logger.info("Worker %s started", index)
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                data = await loop.run_in_executor(None, inbox.get)
+                if data is None:
+                    break
+                await application.update_queue.put(Update.de_json(data, application.bot))
+        finally:
+            await application.stop()
+            await application.shutdown()
+            await application.post_shutdown(application)
+
+    logging_setup.setup_logging(worker_log_path(logging_setup.LOG_PATH, index))
+    asyncio.run(serve())
+
+
+# Front process: the only one talking to getUpdates (or the webhook). It hands every
+# update to its chat's worker and restarts workers that die.
+async def route_updates(workers):
+    import bot
+    from telegram import Bot
+    from telegram.ext import Updater
+
+    context = multiprocessing.get_context('spawn')
+    inboxes = [context.Queue() for _ in range(workers)]
+    processes = [None] * workers
+
+    def start_worker(index):
+        processes[index] = context.Process(target=run_worker, args=(index, inboxes[index]), name=f"bot-worker{index}")
+        processes[index].start()
+
+    for index in range(workers):
+        start_worker(index)
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopping.set)
+
+    update_queue = asyncio.Queue()
+    telegram_bot = Bot(bot.BOT_TOKEN, base_url=f"{bot.BOT_API_URL}/bot", base_file_url=f"{bot.BOT_API_URL}/file/bot")
+    updater = Updater(telegram_bot, update_queue)
+
+    async def forward():
+        while True:
+            update = await update_queue.get()
+            inboxes[partition(update, workers)].put(update.to_dict())
+
+    async def watch():
+        while True:
+            await asyncio.sleep(WORKER_CHECK_INTERVAL)
+            for index, process in enumerate(processes):
+                if not process.is_alive():
+                    logger.error("Worker %s exited with %s, restarting", index, process.exitcode)
+                    start_worker(index)
+
+    async with updater:
+        if bot.WEBHOOK_URL:
+            await updater.start_webhook(
+                listen=bot.WEBHOOK_LISTEN,
+                port=bot.WEBHOOK_PORT,
+                url_path=bot.WEBHOOK_PATH,
+                webhook_url=f"{bot.WEBHOOK_URL.rstrip('/')}/{bot.WEBHOOK_PATH}",
+                secret_token=bot.WEBHOOK_SECRET
+            )
+        else:
+            await updater.start_polling()
+        print(f"Bot is running with {workers} workers...")
+        tasks = [asyncio.create_task(forward()), asyncio.create_task(watch())]
+        await stopping.wait()
+        await updater.stop()
+        for task in tasks:
+            task.cancel()
+
+    # Let the workers drain what they were given, then stop them
+    while not update_queue.empty():
+        update = update_queue.get_nowait()
+        inboxes[partition(update, workers)].put(update.to_dict())
+    for inbox in inboxes:
+        inbox.put(None)
+    for process in processes:
+        await loop.run_in_executor(None, process.join)
+
+
+def main(argv=None):
+    # BOT_WORKERS may come from .env, and bot and its modules read the rest at import
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Run the bot as several worker processes sharing one database.")
+    parser.add_argument('--workers', type=int, default=int(os.getenv('BOT_WORKERS', os.cpu_count() or 1)))
+    args = parser.parse_args(argv)
+
+    # Worker processes inherit this and size their share of the outbound rate limits
+    os.environ['BOT_WORKERS'] = str(args.workers)
+    import bot
+    if bot.WEBHOOK_URL and not bot.WEBHOOK_SECRET:
+        parser.error("WEBHOOK_SECRET must be set when running with WEBHOOK_URL.")
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    asyncio.run(route_updates(args.workers))
+
+
+if __name__ == '__main__':
+    main()